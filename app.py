@@ -1,9 +1,8 @@
 # app.py - Enhanced Version with Music Duration Display
 import streamlit as st
-from mood_analyzer import analyze_mood
 from music_matcher import search_youtube_tracks, get_preferred_track_name, log_user_selection
 from video_editor import add_music_to_video
-from scene_detector import split_video
+from video_analysis import analyze_video
 import cv2
 import tempfile
 import os
@@ -99,7 +98,8 @@ def initialize_state():
             st.session_state[key] = {}
     
     # Initialize single-value session state variables
-    single_keys = ["video_path", "main_mood", "sub_mood", "video_duration", "manual_mode"]
+    single_keys = ["video_path", "main_mood", "sub_mood", "video_duration", "manual_mode", "scene_moods",
+                   "upload_id", "first_frame", "analysis", "analysis_key"]
     for key in single_keys:
         if key not in st.session_state:
             st.session_state[key] = None
@@ -108,15 +108,6 @@ def initialize_state():
     if "manual_mode" not in st.session_state:
         st.session_state.manual_mode = False
 
-def get_video_duration(video_path):
-    """Get video duration in seconds"""
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-    duration = frame_count / fps if fps > 0 else 0
-    cap.release()
-    return duration
-
 def format_time(seconds):
     """Convert seconds to MM:SS format"""
     minutes = int(seconds // 60)
@@ -127,22 +118,70 @@ def time_to_seconds(minutes, seconds):
     """Convert MM:SS to total seconds"""
     return minutes * 60 + seconds
 
+# Scene detection and mood sampling settings used for uploaded videos
+SCENE_THRESHOLD = 30.0
+MIN_SCENE_LEN = 15
+SAMPLES_PER_SCENE = 3
+
+def store_uploaded_video(uploaded):
+    """Write an upload to disk once per distinct file, replacing the previous upload's temp file"""
+    upload_id = getattr(uploaded, "file_id", None) or f"{uploaded.name}_{uploaded.size}"
+    if st.session_state.upload_id == upload_id and st.session_state.video_path and os.path.exists(st.session_state.video_path):
+        return st.session_state.video_path
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as tfile:
+        tfile.write(uploaded.getbuffer())
+
+    previous_path = st.session_state.video_path
+    if previous_path and os.path.exists(previous_path):
+        try:
+            os.unlink(previous_path)
+        except OSError as e:
+            logging.warning(f"Failed to remove previous upload {previous_path}: {e}")
+
+    # Grab the first frame for display once, rather than re-decoding it on every rerun
+    cap = cv2.VideoCapture(tfile.name)
+    ret, frame = cap.read()
+    cap.release()
+
+    st.session_state.upload_id = upload_id
+    st.session_state.video_path = tfile.name
+    st.session_state.first_frame = frame if ret else None
+    st.session_state.analysis = None
+    st.session_state.analysis_key = None
+    return tfile.name
+
+def get_video_analysis(video_path):
+    """Analyze the current upload once per (upload, settings) pair and reuse it across reruns"""
+    analysis_key = (st.session_state.upload_id, SCENE_THRESHOLD, MIN_SCENE_LEN, SAMPLES_PER_SCENE)
+    if st.session_state.analysis_key != analysis_key or st.session_state.analysis is None:
+        with st.spinner("Analyzing video..."):
+            # The mood model loads lazily, so a disk cache hit never pays for it
+            st.session_state.analysis = analyze_video(
+                video_path,
+                threshold=SCENE_THRESHOLD,
+                min_scene_len=MIN_SCENE_LEN,
+                samples_per_scene=SAMPLES_PER_SCENE
+            )
+        st.session_state.analysis_key = analysis_key
+    return st.session_state.analysis
+
 def video_upload_tab():
     st.header("1. Upload and Analyze Video")
     uploaded = st.file_uploader("Upload video (MP4)", type=["mp4"])
     if uploaded:
-        tfile = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-        tfile.write(uploaded.read())
-        st.session_state.video_path = tfile.name
+        video_path = store_uploaded_video(uploaded)
+        frame = st.session_state.first_frame
 
-        cap = cv2.VideoCapture(tfile.name)
-        ret, frame = cap.read()
-        if ret:
+        if frame is not None:
             st.image(frame, channels="BGR", caption="First Frame")
-            main_mood, sub_mood = analyze_mood(frame)
+            analysis = get_video_analysis(video_path)
+            segments = analysis["scenes"]
+            main_mood, sub_mood = analysis["main_mood"], analysis["sub_mood"]
             st.session_state.main_mood = main_mood
             st.session_state.sub_mood = sub_mood
-            st.session_state.video_duration = get_video_duration(tfile.name)
+            st.session_state.scene_moods = analysis["scene_moods"]
+            st.session_state.video_duration = analysis["duration"]
             
             st.success(f"Mood Detected: {main_mood} → {sub_mood}")
             st.info(f"Video Duration: {format_time(st.session_state.video_duration)}")
@@ -157,16 +196,16 @@ def video_upload_tab():
             
             if mode_choice == "Automatic Scene Detection":
                 st.session_state.manual_mode = False
-                segments = split_video(tfile.name)
                 st.session_state.segments = segments
                 st.write(f"Detected {len(segments)} automatic scenes")
+                # With no cuts, scene_moods holds a single whole-video entry that isn't a detected scene
+                scene_moods = st.session_state.scene_moods if len(st.session_state.scene_moods) == len(segments) else None
                 for i, (start, end) in enumerate(segments):
-                    st.write(f"Scene {i+1}: {format_time(start)} - {format_time(end)}")
+                    mood = f" ({scene_moods[i]['main_mood']} → {scene_moods[i]['sub_mood']})" if scene_moods else ""
+                    st.write(f"Scene {i+1}: {format_time(start)} - {format_time(end)}{mood}")
             else:
                 st.session_state.manual_mode = True
                 st.info("You can manually define segments in the Music Selection tab.")
-                
-        cap.release()
 
 def music_tab():
     st.header("2. Music Selection and Assignment")
@@ -474,18 +513,37 @@ def render_tab():
         if effects:
             st.write(f"  • Effects: {', '.join(effects)}")
     
+    # Previews render only the seams or a chosen range, small and fast, to check music placement
+    render_choice = st.radio(
+        "Render:",
+        ["Full video", "Preview seams between segments", "Preview time range"],
+        key="render_choice"
+    )
+    preview = render_choice != "Full video"
+    preview_range = None
+    if render_choice == "Preview time range":
+        video_end = float(st.session_state.video_duration or max(a["end_time"] for a in st.session_state.assignments.values()))
+        preview_range = st.slider(
+            "Preview range (seconds)", 0.0, video_end, (0.0, min(video_end, 20.0)), step=0.5, key="preview_range"
+        )
+    
     output = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4").name
-    if st.button("🎬 Render Video", type="primary"):
-        with st.spinner("Rendering video... This may take a few minutes."):
-            success = add_music_to_video(
+    if st.button("👀 Render Preview" if preview else "🎬 Render Video", type="primary"):
+        with st.spinner("Rendering preview..." if preview else "Rendering video... This may take a few minutes."):
+            result = add_music_to_video(
                 st.session_state.video_path,
                 st.session_state.assignments,
-                output
+                output,
+                preview=preview,
+                preview_range=preview_range
             )
-        if success:
+        if result:
             st.video(output)
-            st.success("🎉 Video rendered successfully!")
-            st.info(f"💾 Your video has been saved temporarily. You can right-click the video above to save it.")
+            st.success("👀 Preview rendered" if preview else "🎉 Video rendered successfully!")
+            st.caption(f"Segments rendered: {result.segments_rendered}/{result.segments_total} "
+                       f"({result.cache_hits} reused from cache, {result.cache_misses} processed)")
+            if not preview:
+                st.info(f"💾 Your video has been saved temporarily. You can right-click the video above to save it.")
         else:
             st.error("❌ Failed to render video. Check the debug.log for details.")
 
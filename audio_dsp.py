@@ -0,0 +1,389 @@
+# audio_dsp.py - Float32 NumPy/SciPy implementations of the audio effects
+import os
+import subprocess
+import numpy as np
+from scipy.signal import butter, lfilter, oaconvolve
+from pydub import AudioSegment
+
+# pydub stores samples as signed integers of these widths
+_SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+# Early reflection delays (ms) shared with the pydub reverb
+REVERB_DELAYS_MS = [50, 75, 125, 150, 200, 250, 300, 375, 450]
+
+def segment_to_array(audio_segment):
+    """Decode an AudioSegment into a (frames, channels) float32 array in [-1, 1]"""
+    dtype = _SAMPLE_DTYPES[audio_segment.sample_width]
+    samples = np.frombuffer(audio_segment.raw_data, dtype=dtype).astype(np.float32)
+    samples *= 1.0 / (1 << (8 * audio_segment.sample_width - 1))
+    return samples.reshape(-1, audio_segment.channels)
+
+def array_to_segment(samples, frame_rate, sample_width=2):
+    """Encode a (frames, channels) float array back into an AudioSegment, clipping instead of wrapping"""
+    scale = (1 << (8 * sample_width - 1)) - 1
+    data = np.clip(samples, -1.0, 1.0) * scale
+    data = data.astype(_SAMPLE_DTYPES[sample_width])
+    return AudioSegment(
+        data=data.tobytes(),
+        sample_width=sample_width,
+        frame_rate=frame_rate,
+        channels=samples.shape[1]
+    )
+
+def _decode_command(path, frame_rate, channels, start_ms, duration_ms, output):
+    command = [AudioSegment.converter, "-nostdin", "-v", "error", "-y"]
+    if start_ms:
+        command += ["-ss", f"{start_ms / 1000:.3f}"]
+    command += ["-i", path]
+    if duration_ms is not None:
+        command += ["-t", f"{duration_ms / 1000:.3f}"]
+    return command + ["-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(frame_rate), output]
+
+def decode_audio(path, frame_rate=44100, channels=2, start_ms=0, duration_ms=None):
+    """
+    Decode (a window of) any file ffmpeg can read into a (frames, channels)
+    float32 array, piped straight from ffmpeg with no intermediate file.
+    ffmpeg also does the resampling and channel remix, so every track comes
+    out at the same rate and layout.
+    """
+    command = _decode_command(path, frame_rate, channels, start_ms, duration_ms, "-")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {result.stderr.decode(errors='replace').strip()}")
+    # frombuffer over bytes is read-only, and the effect chain works in place
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels).copy()
+
+def decode_audio_to_file(path, raw_path, frame_rate=44100, channels=2, start_ms=0, duration_ms=None):
+    """
+    Like decode_audio, but ffmpeg writes the raw float32 samples to raw_path
+    and a read-only memmap over that file is returned, so the decoded audio
+    never has to fit in memory.
+    """
+    command = _decode_command(path, frame_rate, channels, start_ms, duration_ms, raw_path)
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {result.stderr.decode(errors='replace').strip()}")
+    if os.path.getsize(raw_path) == 0:
+        # np.memmap can't map an empty file
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.memmap(raw_path, dtype=np.float32, mode="r").reshape(-1, channels)
+
+def encode_audio(samples, frame_rate, path, codec="aac", bitrate="192k", block_frames=1 << 16):
+    """
+    Encode a (frames, channels) float32 array to a file by piping it into
+    ffmpeg a block at a time, so a memmapped timeline is never loaded whole.
+    """
+    command = [
+        AudioSegment.converter, "-nostdin", "-v", "error", "-y",
+        "-f", "f32le", "-ar", str(frame_rate), "-ac", str(samples.shape[1]), "-i", "-",
+        "-c:a", codec, "-b:a", bitrate, path
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for start in range(0, len(samples), block_frames):
+            process.stdin.write(np.ascontiguousarray(samples[start:start + block_frames], dtype=np.float32).tobytes())
+    except BrokenPipeError:
+        pass  # ffmpeg exited early; its error is reported below
+    finally:
+        process.stdin.close()
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {path}: {stderr.decode(errors='replace').strip()}")
+    return path
+
+def db_to_gain(db):
+    return 10.0 ** (db / 20.0)
+
+def echo(samples, frame_rate, delay_ms=300, decay_factor=0.5, num_echoes=3):
+    """
+    Multi-tap delay line: echo i arrives i * delay_ms late, 6 * i * decay_factor dB quieter.
+    The output is extended by the last echo's delay so the tail isn't cut off.
+    """
+    delay = int(frame_rate * delay_ms / 1000)
+    frames = len(samples)
+    out = np.zeros((frames + delay * num_echoes, samples.shape[1]), dtype=np.float32)
+    out[:frames] = samples
+    for i in range(1, num_echoes + 1):
+        out[delay * i:delay * i + frames] += samples * np.float32(db_to_gain(-6 * i * decay_factor))
+    return out
+
+def reverb_impulse_response(frame_rate, room_size=0.5, damping=0.5):
+    """
+    Impulse response for the reverb: the early reflections of the pydub version
+    followed by an exponentially decaying noise tail whose length grows with
+    room_size, low-pass filtered according to damping. Seeded, so the same
+    settings always produce the same response.
+    """
+    rt60 = 0.3 + 2.0 * room_size
+    length = int(frame_rate * max(rt60, REVERB_DELAYS_MS[-1] / 1000 + 0.05))
+    ir = np.zeros(length, dtype=np.float32)
+
+    for delay in REVERB_DELAYS_MS:
+        ir[int(frame_rate * delay / 1000)] += db_to_gain(-(10 + delay * 0.02))
+
+    # Diffuse tail: -60 dB after rt60 seconds, starting where the early reflections thin out
+    tail_start = int(frame_rate * REVERB_DELAYS_MS[0] / 1000)
+    t = np.arange(length - tail_start, dtype=np.float32) / frame_rate
+    noise = np.random.default_rng(0).standard_normal(len(t)).astype(np.float32)
+    ir[tail_start:] += noise * np.exp(-6.91 * t / rt60).astype(np.float32) * np.float32(db_to_gain(-24))
+
+    if damping > 0:
+        cutoff = 8000 - int(damping * 3000)
+        if cutoff < frame_rate / 2:
+            b, a = butter(2, cutoff, fs=frame_rate)
+            ir = lfilter(b, a, ir).astype(np.float32)
+
+    # Unit energy, so wet_level alone sets how loud the reverb is
+    ir /= np.float32(np.sqrt(np.sum(ir ** 2)) or 1.0)
+    return ir
+
+def reverb(samples, frame_rate, room_size=0.5, damping=0.5, wet_level=0.3):
+    """FFT (overlap-add) convolution reverb; the output keeps the reverb tail"""
+    ir = reverb_impulse_response(frame_rate, room_size, damping)
+    wet = oaconvolve(samples, ir[:, None], mode="full", axes=0).astype(np.float32, copy=False)
+    wet *= np.float32(wet_level)
+    wet[:len(samples)] += samples * np.float32(1.0 - wet_level)
+    return wet
+
+def loop_to_length(samples, frames):
+    """Repeat samples until they cover exactly `frames` frames, in one indexed copy"""
+    if len(samples) == 0:
+        raise ValueError("Cannot loop an empty audio window")
+    if len(samples) >= frames:
+        return samples[:frames].copy()
+    return np.take(samples, np.arange(frames) % len(samples), axis=0)
+
+def pitch_shift(samples, shift_factor):
+    """
+    Play back shift_factor times faster by linear-interpolation resampling.
+    Like the pydub version, this shifts pitch and shortens/lengthens the audio
+    by the same factor.
+    """
+    frames = len(samples)
+    out_frames = max(1, int(round(frames / shift_factor)))
+    positions = np.arange(out_frames, dtype=np.float64) * shift_factor
+    index = np.minimum(positions.astype(np.int64), frames - 1)
+    next_index = np.minimum(index + 1, frames - 1)
+    frac = (positions - index).astype(np.float32)[:, None]
+    out = samples[index]
+    out *= 1.0 - frac
+    out += samples[next_index] * frac
+    return out
+
+def volume_ramp(samples, start_gain_db, end_gain_db):
+    """Apply a gain ramp linear in dB over the whole buffer, in place"""
+    gain = np.linspace(start_gain_db, end_gain_db, len(samples), dtype=np.float32)
+    np.power(np.float32(10.0), gain / np.float32(20.0), out=gain)
+    samples *= gain[:, None]
+    return samples
+
+def fade_in(samples, frames):
+    """Linear amplitude fade-in over the first `frames` frames, in place"""
+    frames = min(frames, len(samples))
+    if frames > 0:
+        samples[:frames] *= np.linspace(0.0, 1.0, frames, endpoint=False, dtype=np.float32)[:, None]
+    return samples
+
+def fade_out(samples, frames):
+    """Linear amplitude fade-out over the last `frames` frames, in place"""
+    frames = min(frames, len(samples))
+    if frames > 0:
+        samples[len(samples) - frames:] *= np.linspace(1.0, 0.0, frames, endpoint=False, dtype=np.float32)[:, None]
+    return samples
+
+def normalize_peak(samples, headroom_db=1.0):
+    """Scale so the peak sits headroom_db below full scale, in place"""
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    if peak > 0:
+        samples *= np.float32(db_to_gain(-headroom_db) / peak)
+    return samples
+
+def apply_effect_chain(samples, frame_rate, effects_list, duration_ms):
+    """
+    Run the selected effects over one float32 buffer, in the same order as the
+    pydub pipeline. Gain-type effects work in place; only pitch shift, echo and
+    reverb (which change the length) allocate a new buffer.
+    """
+    # 1. Pitch effects first (they can change timing)
+    if "Pitch Shift Up" in effects_list:
+        samples = pitch_shift(samples, 1.2)
+    if "Pitch Shift Down" in effects_list:
+        samples = pitch_shift(samples, 0.8)
+
+    # 2. Reverse effect
+    if "Reverse" in effects_list:
+        samples = samples[::-1]
+
+    # 3. Volume effects
+    if not samples.flags.writeable or not samples.flags.c_contiguous:
+        samples = np.ascontiguousarray(samples)
+    if "Volume Ramp Up" in effects_list:
+        volume_ramp(samples, -20, 0)
+    if "Volume Ramp Down" in effects_list:
+        volume_ramp(samples, 0, -20)
+
+    # 4. Spatial effects (Echo, Reverb)
+    if "Echo" in effects_list:
+        samples = echo(samples, frame_rate, delay_ms=250, decay_factor=0.6, num_echoes=3)
+    if "Reverb" in effects_list:
+        samples = reverb(samples, frame_rate, room_size=0.6, damping=0.4, wet_level=0.3)
+
+    # 5. Fade effects (applied last to avoid interfering with other effects)
+    fade_frames = int(frame_rate * min(3000, duration_ms // 3) / 1000)  # Max 3 seconds or 1/3 of duration
+    if "Fade In" in effects_list:
+        fade_in(samples, fade_frames)
+    if "Fade Out" in effects_list:
+        fade_out(samples, fade_frames)
+    return samples
+
+def one_pole_coefficient(frame_rate, time_ms):
+    return np.float32(np.exp(-1000.0 / (frame_rate * max(time_ms, 1e-3))))
+
+def _one_pole(signal, coefficient):
+    """y[n] = (1 - c) * x[n] + c * y[n - 1], run by lfilter over the whole array"""
+    return lfilter(np.array([1.0 - coefficient], dtype=np.float32),
+                   np.array([1.0, -coefficient], dtype=np.float32),
+                   signal)
+
+def compress_dynamics(samples, frame_rate, threshold_db=-20.0, ratio=2.0, attack_ms=5.0, release_ms=50.0):
+    """
+    Feed-forward RMS compressor evaluated over whole arrays, in place.
+    The level detector is a one-pole RMS envelope of the channel-averaged
+    power. Gain reduction is smoothed twice, once with the attack and once
+    with the release time constant, and the deeper of the two is used: it
+    clamps down at attack speed and recovers at release speed without a
+    per-sample Python loop.
+    """
+    if len(samples) == 0:
+        return samples
+    power = np.mean(np.square(samples), axis=1)
+    envelope = _one_pole(power, one_pole_coefficient(frame_rate, attack_ms))
+    level_db = 10.0 * np.log10(np.maximum(envelope, 1e-10))
+
+    reduction_db = np.minimum(threshold_db - level_db, 0.0) * np.float32(1.0 - 1.0 / ratio)
+    reduction_db = np.minimum(
+        _one_pole(reduction_db, one_pole_coefficient(frame_rate, attack_ms)),
+        _one_pole(reduction_db, one_pole_coefficient(frame_rate, release_ms))
+    )
+    samples *= np.power(np.float32(10.0), reduction_db / np.float32(20.0)).astype(np.float32)[:, None]
+    return samples
+
+def k_weighting_filters(frame_rate):
+    """ITU-R BS.1770 pre-filter (high shelf) and RLB high-pass, derived for any sample rate"""
+    # High shelf
+    gain_db, f0, q = 3.999843853973347, 1681.974450955533, 0.7071752369554196
+    k = np.tan(np.pi * f0 / frame_rate)
+    vh = 10.0 ** (gain_db / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+
+    # High-pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / frame_rate)
+    a0 = 1.0 + k / q + k * k
+    highpass_b = [1.0, -2.0, 1.0]
+    highpass_a = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+    return (shelf_b, shelf_a), (highpass_b, highpass_a)
+
+def integrated_loudness(samples, frame_rate):
+    """
+    Gated integrated loudness in LUFS (BS.1770: 400 ms blocks, 75% overlap,
+    -70 LUFS absolute and -10 LU relative gates). Block energies come from a
+    cumulative sum, so no per-block loop over the signal is needed.
+    Returns -inf for silence.
+    """
+    (shelf_b, shelf_a), (highpass_b, highpass_a) = k_weighting_filters(frame_rate)
+    weighted = lfilter(highpass_b, highpass_a, lfilter(shelf_b, shelf_a, samples, axis=0), axis=0)
+
+    block = int(frame_rate * 0.4)
+    step = int(frame_rate * 0.1)
+    energy = np.concatenate([[0.0], np.cumsum(np.sum(np.square(weighted, dtype=np.float64), axis=1))])
+    if len(samples) <= block:
+        block_power = np.array([energy[-1] / max(len(samples), 1)])
+    else:
+        starts = np.arange(0, len(samples) - block + 1, step)
+        block_power = (energy[starts + block] - energy[starts]) / block
+
+    return gated_loudness(block_power)
+
+def gated_loudness(block_power):
+    """Integrated loudness from the mean-square K-weighted power of each 400 ms block"""
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10.0 * np.log10(block_power)
+    gated = block_power[block_loudness > -70.0]
+    if len(gated) == 0:
+        return float("-inf")
+    relative_gate = -0.691 + 10.0 * np.log10(np.mean(gated)) - 10.0
+    gated = block_power[(block_loudness > -70.0) & (block_loudness > relative_gate)]
+    return float(-0.691 + 10.0 * np.log10(np.mean(gated)))
+
+def loudness_gain(loudness, peak, target_lufs=-16.0, peak_ceiling_db=-1.0):
+    """Linear gain taking `loudness` to the target, reduced if it would push `peak` over the ceiling"""
+    if not np.isfinite(loudness):
+        return 1.0
+    gain = db_to_gain(target_lufs - loudness)
+    ceiling = db_to_gain(peak_ceiling_db)
+    if peak * gain > ceiling:
+        gain = ceiling / peak
+    return gain
+
+def normalize_loudness(samples, frame_rate, target_lufs=-16.0, peak_ceiling_db=-1.0):
+    """Gain the buffer to the target integrated loudness, never letting peaks exceed the ceiling; in place"""
+    peak = float(np.max(np.abs(samples))) if len(samples) else 0.0
+    gain = loudness_gain(integrated_loudness(samples, frame_rate), peak, target_lufs, peak_ceiling_db)
+    if gain != 1.0:
+        samples *= np.float32(gain)
+    return samples
+
+def mix_segments(segments, total_frames, channels=2, gain=0.8, background=None, background_gain=0.3,
+                 crossfade_frames=0, out=None, block_frames=None):
+    """
+    Mix processed segments into one preallocated float32 timeline.
+    segments are (start_frame, samples, length_frames): each plays for
+    length_frames from start_frame, and anything past that is dropped. With
+    crossfade_frames, a segment that ends exactly where the next one starts
+    keeps playing into it for up to crossfade_frames of its extra samples,
+    with an equal-power crossfade over the overlap. background (the original
+    audio) is laid underneath at background_gain. Segment buffers are scaled
+    in place. Segments starting at or past total_frames are left out.
+    out is an existing zeroed timeline (e.g. a memmap) to mix into, and
+    block_frames bounds how much of a segment is worked on at once.
+    """
+    if out is None:
+        out = np.zeros((total_frames, channels), dtype=np.float32)
+    if background is not None:
+        frames = min(len(background), total_frames)
+        for start, end in _blocks(frames, block_frames):
+            out[start:end] += background[start:end] * np.float32(background_gain)
+
+    segments = sorted(segments, key=lambda segment: segment[0])
+    fade_in_frames = 0
+    for i, (start, samples, length) in enumerate(segments):
+        if start >= total_frames:
+            fade_in_frames = 0
+            continue
+        overlap = 0
+        if crossfade_frames and i + 1 < len(segments) and segments[i + 1][0] == start + length:
+            overlap = max(0, min(crossfade_frames, len(samples) - length, segments[i + 1][2]))
+
+        part = samples[:max(0, min(length + overlap, total_frames - start))]
+        for block_start, block_end in _blocks(len(part), block_frames):
+            block = part[block_start:block_end]
+            block *= np.float32(gain)
+            if block_start < fade_in_frames:
+                t = (np.arange(block_start, min(block_end, fade_in_frames), dtype=np.float32) + 0.5) / fade_in_frames
+                block[:len(t)] *= np.sin(t * np.float32(np.pi / 2))[:, None]
+            if overlap and block_end > length:
+                first = max(block_start, length)
+                t = (np.arange(first - length, block_end - length, dtype=np.float32) + 0.5) / overlap
+                block[first - block_start:] *= np.cos(t * np.float32(np.pi / 2))[:, None]
+            out[start + block_start:start + block_end] += block
+        fade_in_frames = overlap
+    return out
+
+def _blocks(frames, block_frames=None):
+    """(start, end) ranges covering `frames` frames, block_frames at a time (all at once if None)"""
+    step = block_frames or max(frames, 1)
+    return [(start, min(start + step, frames)) for start in range(0, frames, step)]
@@ -0,0 +1,256 @@
+# audio_stream.py - Block-wise segment processing with bounded memory
+import os
+import numpy as np
+from scipy.signal import lfilter, oaconvolve
+import audio_dsp
+
+# Frames handled per block (~1.5 s at 44.1 kHz)
+BLOCK_FRAMES = 1 << 16
+
+# Scratch buffers are raw float32 files on disk, mapped a block at a time
+def open_scratch(path, frames, channels):
+    """A zero-filled (frames, channels) float32 memmap backed by `path`"""
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="w+", shape=(frames, channels))
+
+def _looped_reader(window):
+    def read(index):
+        return np.asarray(window[index % len(window)], dtype=np.float32)
+    return read
+
+def _pitched_reader(read, length, shift_factor):
+    """Index form of audio_dsp.pitch_shift: output frame j interpolates input position j * shift_factor"""
+    def pitched(index):
+        positions = index.astype(np.float64) * shift_factor
+        base = np.minimum(positions.astype(np.int64), length - 1)
+        following = np.minimum(base + 1, length - 1)
+        frac = (positions - base).astype(np.float32)[:, None]
+        out = read(base)
+        out *= 1.0 - frac
+        out += read(following) * frac
+        return out
+    return pitched
+
+def _reversed_reader(read, length):
+    def reversed_read(index):
+        return read(length - 1 - index)
+    return reversed_read
+
+def source_reader(window, frames, effects_list):
+    """
+    The looped, pitch-shifted and reversed signal as a function from output
+    frame indices to samples, plus its length. Looping, resampling and
+    reversing are all index arithmetic over the decoded window, so none of
+    the intermediate signals is ever materialized.
+    """
+    if len(window) == 0:
+        raise ValueError("Cannot loop an empty audio window")
+    read, length = _looped_reader(window), frames
+    for effect, factor in (("Pitch Shift Up", 1.2), ("Pitch Shift Down", 0.8)):
+        if effect in effects_list:
+            read = _pitched_reader(read, length, factor)
+            length = max(1, int(round(length / factor)))
+    if "Reverse" in effects_list:
+        read = _reversed_reader(read, length)
+    return read, length
+
+def _ramp_gain(index, length, start_gain_db, end_gain_db):
+    """Per-frame gain of audio_dsp.volume_ramp for the given frame indices"""
+    step = (end_gain_db - start_gain_db) / (length - 1) if length > 1 else 0.0
+    return np.power(np.float32(10.0), (start_gain_db + step * index).astype(np.float32) / np.float32(20.0))
+
+def source_blocks(read, length, effects_list, block_frames=BLOCK_FRAMES):
+    """Yield the source signal a block at a time, with the volume ramps applied"""
+    for start in range(0, length, block_frames):
+        index = np.arange(start, min(start + block_frames, length))
+        block = read(index)
+        if "Volume Ramp Up" in effects_list:
+            block *= _ramp_gain(index, length, -20, 0)[:, None]
+        if "Volume Ramp Down" in effects_list:
+            block *= _ramp_gain(index, length, 0, -20)[:, None]
+        yield block
+
+def echo_blocks(blocks, frame_rate, delay_ms=300, decay_factor=0.5, num_echoes=3):
+    """Block form of audio_dsp.echo: a delay line carries the last delay * num_echoes input frames"""
+    delay = int(frame_rate * delay_ms / 1000)
+    history_frames = delay * num_echoes
+    gains = [np.float32(audio_dsp.db_to_gain(-6 * i * decay_factor)) for i in range(1, num_echoes + 1)]
+    history = None
+    for block in blocks:
+        if history is None:
+            history = np.zeros((history_frames, block.shape[1]), dtype=np.float32)
+        extended = np.concatenate([history, block])
+        out = block.copy()
+        for i, gain in enumerate(gains, start=1):
+            offset = history_frames - delay * i
+            out += extended[offset:offset + len(block)] * gain
+        history = extended[len(extended) - history_frames:]
+        yield out
+    # Let the echoes ring out after the input ends
+    if history is not None and history_frames:
+        tail = np.zeros_like(history)
+        for i, gain in enumerate(gains, start=1):
+            tail[:delay * i] += history[history_frames - delay * i:] * gain
+        yield tail
+
+def reverb_blocks(blocks, frame_rate, room_size=0.5, damping=0.5, wet_level=0.3):
+    """Block form of audio_dsp.reverb: overlap-add convolution carrying the reverb tail between blocks"""
+    ir = audio_dsp.reverb_impulse_response(frame_rate, room_size, damping)[:, None]
+    tail = None
+    for block in blocks:
+        wet = oaconvolve(block, ir, mode="full", axes=0).astype(np.float32, copy=False)
+        wet *= np.float32(wet_level)
+        if tail is not None:
+            wet[:len(tail)] += tail
+        wet[:len(block)] += block * np.float32(1.0 - wet_level)
+        tail = wet[len(block):].copy()
+        yield wet[:len(block)]
+    if tail is not None:
+        yield tail
+
+def effect_blocks(window, frame_rate, effects_list, duration_ms, block_frames=BLOCK_FRAMES):
+    """
+    Block form of looping a window to duration_ms and running
+    audio_dsp.apply_effect_chain on it. Returns (blocks, total_frames): a
+    generator of output blocks and the length they add up to, which the
+    fades need before the last block is produced.
+    """
+    read, length = source_reader(window, int(frame_rate * duration_ms / 1000), effects_list)
+    blocks = source_blocks(read, length, effects_list, block_frames)
+    total_frames = length
+    if "Echo" in effects_list:
+        blocks = echo_blocks(blocks, frame_rate, delay_ms=250, decay_factor=0.6, num_echoes=3)
+        total_frames += int(frame_rate * 250 / 1000) * 3
+    if "Reverb" in effects_list:
+        blocks = reverb_blocks(blocks, frame_rate, room_size=0.6, damping=0.4, wet_level=0.3)
+        total_frames += len(audio_dsp.reverb_impulse_response(frame_rate, 0.6, 0.4)) - 1
+
+    fade_frames = min(int(frame_rate * min(3000, duration_ms // 3) / 1000), total_frames)
+    fade_in = "Fade In" in effects_list and fade_frames > 0
+    fade_out = "Fade Out" in effects_list and fade_frames > 0
+
+    def faded():
+        position = 0
+        for block in blocks:
+            index = np.arange(position, position + len(block), dtype=np.float64)
+            if fade_in and position < fade_frames:
+                block *= np.minimum(index / fade_frames, 1.0).astype(np.float32)[:, None]
+            if fade_out and position + len(block) > total_frames - fade_frames:
+                block *= np.minimum((total_frames - index) / fade_frames, 1.0).astype(np.float32)[:, None]
+            position += len(block)
+            yield block
+    return faded(), total_frames
+
+def _one_pole_coefficients(frame_rate, time_ms):
+    coefficient = audio_dsp.one_pole_coefficient(frame_rate, time_ms)
+    return np.array([1.0 - coefficient], dtype=np.float32), np.array([1.0, -coefficient], dtype=np.float32)
+
+def compress_in_place(samples, frame_rate, pre_gain=1.0, threshold_db=-20.0, ratio=2.0, attack_ms=5.0,
+                      release_ms=50.0, block_frames=BLOCK_FRAMES):
+    """
+    audio_dsp.compress_dynamics (after a fixed pre_gain) over a memmap, a
+    block at a time, carrying the state of its three one-pole filters.
+    """
+    attack = _one_pole_coefficients(frame_rate, attack_ms)
+    release = _one_pole_coefficients(frame_rate, release_ms)
+    envelope_state = np.zeros(1, dtype=np.float32)
+    attack_state = np.zeros(1, dtype=np.float32)
+    release_state = np.zeros(1, dtype=np.float32)
+    for start in range(0, len(samples), block_frames):
+        block = np.array(samples[start:start + block_frames])
+        block *= np.float32(pre_gain)
+        power = np.mean(np.square(block), axis=1)
+        envelope, envelope_state = lfilter(*attack, power, zi=envelope_state)
+        level_db = 10.0 * np.log10(np.maximum(envelope, 1e-10))
+        reduction_db = np.minimum(threshold_db - level_db, 0.0) * np.float32(1.0 - 1.0 / ratio)
+        attacked, attack_state = lfilter(*attack, reduction_db, zi=attack_state)
+        released, release_state = lfilter(*release, reduction_db, zi=release_state)
+        block *= np.power(np.float32(10.0), np.minimum(attacked, released) / np.float32(20.0)).astype(np.float32)[:, None]
+        samples[start:start + len(block)] = block
+
+def measure_loudness(samples, frame_rate, block_frames=BLOCK_FRAMES):
+    """
+    audio_dsp.integrated_loudness over a memmap, a block at a time: the
+    K-weighting filters carry their state, and only the running energy at
+    the 400 ms gating block boundaries is kept. Returns (loudness, peak).
+    """
+    (shelf_b, shelf_a), (highpass_b, highpass_a) = audio_dsp.k_weighting_filters(frame_rate)
+    frames, channels = samples.shape
+    gate_block = int(frame_rate * 0.4)
+    gate_step = int(frame_rate * 0.1)
+    if frames <= gate_block:
+        boundaries = np.array([frames])
+    else:
+        starts = np.arange(0, frames - gate_block + 1, gate_step)
+        boundaries = np.union1d(starts, starts + gate_block)
+    energy_at = np.zeros(len(boundaries))
+
+    shelf_state = np.zeros((2, channels))
+    highpass_state = np.zeros((2, channels))
+    running_energy = 0.0
+    peak = 0.0
+    for start in range(0, frames, block_frames):
+        block = np.asarray(samples[start:start + block_frames])
+        peak = max(peak, float(np.max(np.abs(block))))
+        weighted, shelf_state = lfilter(shelf_b, shelf_a, block, axis=0, zi=shelf_state)
+        weighted, highpass_state = lfilter(highpass_b, highpass_a, weighted, axis=0, zi=highpass_state)
+        energy = running_energy + np.cumsum(np.sum(np.square(weighted, dtype=np.float64), axis=1))
+        # energy[k] is the energy of frames [0, start + k + 1)
+        inside = (boundaries > start) & (boundaries <= start + len(block))
+        energy_at[inside] = energy[boundaries[inside] - start - 1]
+        running_energy = energy[-1]
+
+    if frames == 0:
+        return float("-inf"), 0.0
+    if frames <= gate_block:
+        block_power = np.array([energy_at[0] / frames])
+    else:
+        # Boundary 0 is never inside a block, so its energy stays 0
+        block_power = (energy_at[np.searchsorted(boundaries, starts + gate_block)]
+                       - energy_at[np.searchsorted(boundaries, starts)]) / gate_block
+    return audio_dsp.gated_loudness(block_power), peak
+
+def scale_in_place(samples, gain, block_frames=BLOCK_FRAMES):
+    for start in range(0, len(samples), block_frames):
+        samples[start:start + block_frames] *= np.float32(gain)
+
+def process_segment_streaming(window, frame_rate, effects_list, duration_ms, out_path, target_lufs=-16.0,
+                              block_frames=BLOCK_FRAMES):
+    """
+    Bounded-memory equivalent of the numpy segment pipeline. The processed
+    segment is written to a memmap at out_path and then revisited in place,
+    block_frames at a time: effects (tracking the peak), peak normalization
+    with compression, loudness measurement, and the loudness gain. Returns
+    the memmap.
+    """
+    blocks, total_frames = effect_blocks(window, frame_rate, effects_list, duration_ms, block_frames)
+    channels = window.shape[1]
+    samples = open_scratch(out_path, total_frames, channels)
+
+    # Pass 1: effects
+    peak = 0.0
+    position = 0
+    for block in blocks:
+        samples[position:position + len(block)] = block
+        peak = max(peak, float(np.max(np.abs(block))))
+        position += len(block)
+
+    # Pass 2: normalize_peak (1 dB headroom) folded into the compressor's input
+    pre_gain = audio_dsp.db_to_gain(-1.0) / peak if peak > 0 else 1.0
+    compress_in_place(samples, frame_rate, pre_gain, threshold_db=-20.0, ratio=2.0, block_frames=block_frames)
+
+    # Passes 3 and 4: measure the loudness, then apply the gain
+    loudness, peak = measure_loudness(samples, frame_rate, block_frames)
+    gain = audio_dsp.loudness_gain(loudness, peak, target_lufs, peak_ceiling_db=-1.0)
+    if gain != 1.0:
+        scale_in_place(samples, gain, block_frames)
+    if isinstance(samples, np.memmap):
+        samples.flush()
+    return samples
+
+def open_processed_segment(out_path, channels):
+    """Map a segment written by process_segment_streaming back in, read-write for the mixer"""
+    if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        return np.zeros((0, channels), dtype=np.float32)
+    return np.memmap(out_path, dtype=np.float32, mode="r+").reshape(-1, channels)
@@ -0,0 +1,58 @@
+"""
+Compare the NumPy echo/reverb engine with the original pydub overlay versions.
+
+Run from the repository root:
+    python -m benchmarks.bench_audio_effects --durations 30 180
+
+Generates stereo 44.1 kHz test audio of each duration and reports the time
+each engine takes per effect, and the speedup of the NumPy engine.
+"""
+import argparse
+import time
+import numpy as np
+import audio_dsp
+import video_editor
+
+EFFECTS = {
+    "echo": (
+        lambda seg: video_editor.create_echo_effect_pydub(seg, delay_ms=250, decay_factor=0.6, num_echoes=3),
+        lambda x, sr: audio_dsp.echo(x, sr, delay_ms=250, decay_factor=0.6, num_echoes=3),
+    ),
+    "reverb": (
+        lambda seg: video_editor.create_reverb_effect_pydub(seg, room_size=0.6, damping=0.4, wet_level=0.3),
+        lambda x, sr: audio_dsp.reverb(x, sr, room_size=0.6, damping=0.4, wet_level=0.3),
+    ),
+}
+
+def make_test_audio(seconds, frame_rate=44100):
+    """Two detuned tones plus a little noise, as a 16-bit stereo AudioSegment"""
+    t = np.arange(int(seconds * frame_rate), dtype=np.float32) / frame_rate
+    rng = np.random.default_rng(0)
+    left = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    right = 0.3 * np.sin(2 * np.pi * 331 * t) + 0.05 * rng.standard_normal(len(t))
+    return audio_dsp.array_to_segment(np.stack([left, right], axis=1).astype(np.float32), frame_rate)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 180])
+    parser.add_argument("--effects", nargs="+", default=list(EFFECTS))
+    args = parser.parse_args()
+
+    print(f"{'effect':<10}{'duration s':>12}{'pydub s':>10}{'numpy s':>10}{'speedup':>10}")
+    for seconds in args.durations:
+        segment = make_test_audio(seconds)
+        for name in args.effects:
+            pydub_fn, numpy_fn = EFFECTS[name]
+            pydub_time = timed(pydub_fn, segment)
+            # Includes the AudioSegment <-> float32 conversions the editor performs
+            numpy_time = timed(lambda seg: audio_dsp.array_to_segment(
+                numpy_fn(audio_dsp.segment_to_array(seg), seg.frame_rate), seg.frame_rate), segment)
+            print(f"{name:<10}{seconds:>12.0f}{pydub_time:>10.2f}{numpy_time:>10.2f}{pydub_time / numpy_time:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Compare the NumPy compressor + loudness normalizer with pydub's normalize + compress_dynamic_range.
+
+Run from the repository root:
+    python -m benchmarks.bench_dynamics --durations 30 180 600
+
+Generates stereo 44.1 kHz test audio of each duration and reports the time
+each implementation takes for the final dynamics stage of a segment, plus
+the integrated loudness of the NumPy output.
+"""
+import argparse
+import time
+import audio_dsp
+from pydub.effects import normalize, compress_dynamic_range
+from benchmarks.bench_audio_effects import make_test_audio
+
+def pydub_dynamics(segment):
+    return compress_dynamic_range(normalize(segment, headroom=1.0), threshold=-20.0, ratio=2.0)
+
+def numpy_dynamics(segment, target_lufs):
+    # Includes the AudioSegment <-> float32 conversions the editor performs
+    samples = audio_dsp.segment_to_array(segment)
+    audio_dsp.normalize_peak(samples, headroom_db=1.0)
+    audio_dsp.compress_dynamics(samples, segment.frame_rate, threshold_db=-20.0, ratio=2.0)
+    audio_dsp.normalize_loudness(samples, segment.frame_rate, target_lufs, peak_ceiling_db=-1.0)
+    audio_dsp.array_to_segment(samples, segment.frame_rate, segment.sample_width)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 180, 600])
+    parser.add_argument("--target-lufs", type=float, default=-16.0)
+    parser.add_argument("--skip-pydub", action="store_true", help="only time the NumPy stage")
+    args = parser.parse_args()
+
+    print(f"{'duration s':>10}{'pydub s':>10}{'numpy s':>10}{'speedup':>10}{'LUFS':>8}")
+    for seconds in args.durations:
+        segment = make_test_audio(seconds)
+        pydub_time = float("nan")
+        if not args.skip_pydub:
+            start = time.perf_counter()
+            pydub_dynamics(segment)
+            pydub_time = time.perf_counter() - start
+        start = time.perf_counter()
+        samples = numpy_dynamics(segment, args.target_lufs)
+        numpy_time = time.perf_counter() - start
+        loudness = audio_dsp.integrated_loudness(samples, segment.frame_rate)
+        print(f"{seconds:>10.0f}{pydub_time:>10.2f}{numpy_time:>10.2f}{pydub_time / numpy_time:>9.1f}x{loudness:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare mood inference backends against the eager fp32 reference.
+
+Run from the repository root:
+    python -m benchmarks.bench_mood_inference --video sample.mp4 --threads 4
+
+Reports single-frame latency, batched throughput and how often each backend
+agrees with the eager model on the predicted class and sub-mood.
+"""
+import argparse
+import statistics
+import time
+import cv2
+import numpy as np
+import mood_analyzer
+
+def load_frames(video_path, count):
+    if not video_path:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(count)]
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for idx in np.linspace(0, max(total - 1, 0), count).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+def bench_backend(backend, frames, batch_size, repeats):
+    build_start = time.perf_counter()
+    model = mood_analyzer.build_model(backend)
+    build_time = time.perf_counter() - build_start
+    mood_analyzer.predict_class_indices(frames[:1], model=model)
+
+    latencies = []
+    for frame in frames[:repeats]:
+        start = time.perf_counter()
+        mood_analyzer.predict_class_indices([frame], model=model)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    indices = mood_analyzer.predict_class_indices(frames, batch_size=batch_size, model=model)
+    throughput = len(frames) / (time.perf_counter() - start)
+    return build_time, statistics.median(latencies), throughput, indices
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Sample frames from this video instead of random noise")
+    parser.add_argument("--frames", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=10, help="Single-frame latency samples")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--interop-threads", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=mood_analyzer.MOOD_BACKENDS)
+    args = parser.parse_args()
+
+    mood_analyzer.configure_threads(args.threads, args.interop_threads)
+    frames = load_frames(args.video, args.frames)
+    print(f"{len(frames)} frames, batch size {args.batch_size}")
+
+    backends = ["eager"] + [b for b in args.backends if b != "eager"]
+    reference = None
+    print(f"{'backend':<24}{'build s':>9}{'latency ms':>12}{'frames/s':>10}{'class agree':>13}{'mood agree':>12}")
+    for backend in backends:
+        build_time, latency, throughput, indices = bench_backend(backend, frames, args.batch_size, args.repeats)
+        if reference is None:
+            reference = indices
+        class_agree = np.mean([a == b for a, b in zip(indices, reference)])
+        mood_agree = np.mean([a % len(mood_analyzer.MOOD_CLASSES) == b % len(mood_analyzer.MOOD_CLASSES)
+                              for a, b in zip(indices, reference)])
+        print(f"{backend:<24}{build_time:>9.2f}{latency * 1000:>12.1f}{throughput:>10.1f}"
+              f"{class_agree:>12.1%}{mood_agree:>12.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare scene detection modes against the previous VideoManager implementation.
+
+Run from the repository root:
+    python -m benchmarks.bench_scene_detection clip1.mp4 clip2.mp4 --modes accurate balanced fast
+
+For every video and mode, reports seconds of processing per minute of
+video and how well the cuts agree with the reference: recall/precision of
+cuts matched within --tolerance frames, and the mean offset of matched cuts.
+"""
+import argparse
+import time
+from scenedetect import VideoManager, SceneManager
+from scenedetect.detectors import ContentDetector
+import scene_detector
+
+def reference_split_video(video_path, threshold=30.0, min_scene_len=15):
+    """The original deprecated-backend implementation, kept here as the baseline"""
+    video_manager = VideoManager([video_path])
+    scene_manager = SceneManager()
+    scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_scene_len))
+    base_timecode = video_manager.get_base_timecode()
+    video_manager.set_downscale_factor()
+    video_manager.start()
+    scene_manager.detect_scenes(frame_source=video_manager)
+    scene_list = scene_manager.get_scene_list(base_timecode)
+    fps = video_manager.get_framerate()
+    video_manager.release()
+    return [(scene[0].get_seconds(), scene[1].get_seconds()) for scene in scene_list], fps
+
+def cut_times(scenes):
+    return [start for start, _ in scenes[1:]]
+
+def match_cuts(reference, candidate, tolerance_sec):
+    """Greedy one-to-one matching of cut times within the tolerance"""
+    unmatched = list(candidate)
+    offsets = []
+    for cut in reference:
+        if not unmatched:
+            break
+        nearest = min(unmatched, key=lambda c: abs(c - cut))
+        if abs(nearest - cut) <= tolerance_sec:
+            offsets.append(abs(nearest - cut))
+            unmatched.remove(nearest)
+    return offsets
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--modes", nargs="+", default=list(scene_detector.SCENE_DETECTION_MODES))
+    parser.add_argument("--workers", type=int, default=0, help="Also time the parallel mode with this many workers")
+    parser.add_argument("--threshold", type=float, default=30.0)
+    parser.add_argument("--min-scene-len", type=int, default=15)
+    parser.add_argument("--tolerance", type=int, default=2, help="Cut match tolerance in frames")
+    args = parser.parse_args()
+
+    print(f"{'video':<28}{'mode':<14}{'s/min':>8}{'cuts':>6}{'recall':>9}{'precision':>11}{'offset ms':>11}")
+    for video_path in args.videos:
+        (reference, fps), ref_time = timed(reference_split_video, video_path, args.threshold, args.min_scene_len)
+        minutes = (reference[-1][1] if reference else 0) / 60 or 1
+        reference_cuts = cut_times(reference)
+        name = video_path[-27:]
+        print(f"{name:<28}{'reference':<14}{ref_time / minutes:>8.2f}{len(reference_cuts):>6}")
+
+        runs = [(mode, {"mode": mode, "workers": 1}) for mode in args.modes]
+        if args.workers > 1:
+            runs.append((f"parallel x{args.workers}", {"workers": args.workers}))
+        for label, kwargs in runs:
+            scenes, elapsed = timed(scene_detector.split_video, video_path, args.threshold, args.min_scene_len, **kwargs)
+            cuts = cut_times(scenes)
+            offsets = match_cuts(reference_cuts, cuts, args.tolerance / fps)
+            recall = len(offsets) / len(reference_cuts) if reference_cuts else 1.0
+            precision = len(offsets) / len(cuts) if cuts else 1.0
+            mean_offset = sum(offsets) / len(offsets) * 1000 if offsets else 0.0
+            print(f"{'':<28}{label:<14}{elapsed / minutes:>8.2f}{len(cuts):>6}"
+                  f"{recall:>9.1%}{precision:>11.1%}{mean_offset:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import tempfile
+import time
+
+# Root for every persistent cache the app keeps (analysis results, audio, ...)
+CACHE_ROOT = os.getenv(
+    "MOOD_DESIGNER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ai_music_mood_designer")
+)
+
+# Bytes read from the start, middle and end of a file when fingerprinting it
+FINGERPRINT_CHUNK = 1024 * 1024
+
+def cache_dir(name):
+    """Return (and create) the directory for a named cache"""
+    path = os.path.join(CACHE_ROOT, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def file_fingerprint(path):
+    """
+    Fast content hash of a file.
+    Hashes the size plus three 1 MB chunks (head, middle, tail) instead of the
+    whole file, so multi-GB uploads fingerprint in milliseconds.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - FINGERPRINT_CHUNK // 2), max(0, size - FINGERPRINT_CHUNK)}):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()
+
+def hash_key(*parts):
+    """Stable hex key for any JSON-serializable parameters"""
+    payload = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def atomic_write_bytes(path, data):
+    """Write a file so concurrent readers see either the old or the complete new content"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_write_json(path, data):
+    atomic_write_bytes(path, json.dumps(data).encode())
+
+def atomic_save_array(path, array):
+    """np.save with the same all-or-nothing guarantee; memmapped arrays are streamed, not loaded"""
+    import numpy as np
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def touch(path):
+    """Mark a cache entry as recently used"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def read_json(path):
+    """Load a cached JSON entry, or None if it is missing or unreadable"""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+    touch(path)
+    return data
+
+def evict_lru(directory, max_bytes):
+    """Delete least recently used entries until the directory fits in max_bytes"""
+    entries = []
+    total = 0
+    stale_before = time.time() - 3600
+    for entry in os.scandir(directory):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.name.startswith(".tmp"):
+            # Leftovers from writers that died mid-write
+            if stat.st_mtime < stale_before:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+            continue
+        if not entry.is_file():
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Another process evicted it first
+            pass
+        total -= size
@@ -1,10 +1,24 @@
+import gc
+import os
+import logging
+import threading
+from collections import Counter
+import cv2
+import numpy as np
 import torch
-import torchvision.transforms as transforms
-from torchvision.models import resnet50, ResNet50_Weights
 
-# Load the pretrained ResNet50 model
-model = resnet50(weights=ResNet50_Weights.DEFAULT)
-model.eval()
+# Inference backend: "eager" is the fp32 reference; the others trade a little accuracy for CPU speed
+MOOD_BACKENDS = ["eager", "quantized", "torchscript", "quantized_torchscript"]
+MOOD_BACKEND = os.getenv("MOOD_BACKEND", "eager")
+MOOD_NUM_THREADS = int(os.getenv("MOOD_NUM_THREADS", "0"))
+MOOD_INTEROP_THREADS = int(os.getenv("MOOD_INTEROP_THREADS", "0"))
+
+# Bump when weights, preprocessing or label mapping change so cached analyses are invalidated
+MODEL_VERSION = "resnet50-imagenet-default-rgb-2"
+
+# The pretrained ResNet50 is loaded on first use and shared by every session in the process
+_models = {}
+_model_lock = threading.Lock()
 
 # Sub-moods the model is trained to recognize
 MOOD_CLASSES = [
@@ -26,14 +40,33 @@ MOOD_CATEGORIES = {
     "Surprised": ["shocked", "amazed", "excited"]
 }
 
-# Image preprocessing pipeline
-transform = transforms.Compose([
-    transforms.ToPILImage(),
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225])
-])
+# Image preprocessing: ImageNet mean/std expressed on the 0-255 pixel scale
+INPUT_SIZE = 224
+_PIXEL_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255
+_PIXEL_INV_STD = 1.0 / (np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255)
+
+def resize_frames(frames, out=None):
+    """Resize BGR frames into an (N, 224, 224, 3) uint8 stack with cv2 INTER_AREA"""
+    if out is None:
+        out = np.empty((len(frames), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        cv2.resize(frame, (INPUT_SIZE, INPUT_SIZE), dst=out[i], interpolation=cv2.INTER_AREA)
+    return out
+
+def normalize_frames(resized, out=None):
+    """Turn an (N, 224, 224, 3) BGR uint8 stack into a normalized (N, 3, 224, 224) float32 RGB array"""
+    if out is None:
+        out = np.empty((len(resized), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    for c in range(3):
+        # Output channel c (RGB order) reads input channel 2 - c (BGR order)
+        channel = out[:, c]
+        np.subtract(resized[..., 2 - c], _PIXEL_MEAN[c], out=channel, dtype=np.float32)
+        np.multiply(channel, _PIXEL_INV_STD[c], out=channel)
+    return out
+
+def preprocess_frames(frames, resized_buffer=None, out=None):
+    """Resize and normalize a stack of BGR frames, ready for torch.from_numpy"""
+    return normalize_frames(resize_frames(frames, resized_buffer), out)
 
 # Helper to get main mood category from sub-mood
 def get_main_mood(sub_mood):
@@ -42,15 +75,220 @@ def get_main_mood(sub_mood):
             return main
     return "Neutral"
 
+# Threads are configured once, before the first model is built
+_threads_configured = False
+
+def configure_threads(num_threads=None, interop_threads=None):
+    """Apply intra-op/inter-op thread settings (0 keeps the torch default)"""
+    global _threads_configured
+    num_threads = MOOD_NUM_THREADS if num_threads is None else num_threads
+    interop_threads = MOOD_INTEROP_THREADS if interop_threads is None else interop_threads
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Can only be set before any inter-op parallel work has started
+            logging.warning(f"Could not set inter-op threads: {e}")
+    _threads_configured = True
+
+def _load_resnet50():
+    from torchvision.models import resnet50, ResNet50_Weights
+    model = resnet50(weights=ResNet50_Weights.DEFAULT)
+    model.eval()
+    return model
+
+def _to_torchscript(model):
+    example = torch.zeros(1, 3, 224, 224)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced)
+    return torch.jit.optimize_for_inference(frozen)
+
+def build_model(backend):
+    """Build a fresh mood model for the given inference backend"""
+    if backend not in MOOD_BACKENDS:
+        raise ValueError(f"Unknown mood backend: {backend}")
+    model = _load_resnet50()
+    if backend in ("quantized", "quantized_torchscript"):
+        # Dynamic int8 quantization covers the Linear layers (ResNet50's classifier head)
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend in ("torchscript", "quantized_torchscript"):
+        model = _to_torchscript(model)
+    return model
+
+def get_model(backend=None):
+    """Return the process-wide model for a backend, loading the weights on first call"""
+    backend = backend or MOOD_BACKEND
+    model = _models.get(backend)
+    if model is None:
+        with _model_lock:
+            model = _models.get(backend)
+            if model is None:
+                if not _threads_configured:
+                    configure_threads()
+                model = build_model(backend)
+                _models[backend] = model
+                logging.info(f"Loaded ResNet50 mood model ({backend} backend)")
+    return model
+
+def warm_up(backend=None):
+    """
+    Load the model and run a dummy two-frame batch through the resized-frame
+    path analyses use, so the first real request is fast and a broken
+    preprocessing path fails here instead of in every analysis.
+    """
+    model = get_model(backend)
+    blank = np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    predict_resized_class_indices([blank, blank], model=model)
+    return model
+
+def preload_for_workers(backend=None):
+    """
+    Load the model in a parent process before it forks workers.
+    Forked children then share the weight pages copy-on-write instead of each
+    loading their own copy. Objects alive now are moved out of the garbage
+    collector's reach so its bookkeeping doesn't dirty the shared pages.
+    """
+    model = warm_up(backend)
+    for param in model.parameters():
+        param.requires_grad_(False)
+    gc.collect()
+    gc.freeze()
+    return model
+
+# Raw ImageNet class indices for a list of frames, batch_size frames per forward pass
+def predict_class_indices(frames, batch_size=16, model=None):
+    if model is None:
+        model = get_model()
+    indices = []
+    # Buffers are allocated once and reused for every batch
+    size = min(batch_size, len(frames))
+    resized_buffer = np.empty((size, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+    input_buffer = np.empty((size, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    for i in range(0, len(frames), batch_size):
+        batch = frames[i:i + batch_size]
+        n = len(batch)
+        input_tensor = torch.from_numpy(preprocess_frames(batch, resized_buffer[:n], input_buffer[:n]))
+        with torch.inference_mode():
+            outputs = model(input_tensor)
+        indices.extend(torch.argmax(outputs, 1).tolist())
+    return indices
+
+# Same as predict_class_indices for frames already shrunk by resize_frames (a stack or a list of them)
+def predict_resized_class_indices(resized, batch_size=16, model=None):
+    if model is None:
+        model = get_model()
+    indices = []
+    input_buffer = np.empty((min(batch_size, len(resized)), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    for i in range(0, len(resized), batch_size):
+        batch = np.asarray(resized[i:i + batch_size])
+        input_tensor = torch.from_numpy(normalize_frames(batch, input_buffer[:len(batch)]))
+        with torch.inference_mode():
+            outputs = model(input_tensor)
+        indices.extend(torch.argmax(outputs, 1).tolist())
+    return indices
+
+def to_sub_moods(class_indices):
+    return [MOOD_CLASSES[idx % len(MOOD_CLASSES)] for idx in class_indices]
+
+def predict_sub_moods(frames, batch_size=16, model=None):
+    return to_sub_moods(predict_class_indices(frames, batch_size, model))
+
 # Core mood analysis function
 def analyze_mood(frame):
     try:
-        input_tensor = transform(frame).unsqueeze(0)
-        with torch.no_grad():
-            outputs = model(input_tensor)
-        predicted_idx = torch.argmax(outputs, 1).item()
-        sub_mood = MOOD_CLASSES[predicted_idx % len(MOOD_CLASSES)]
+        sub_mood = predict_sub_moods([frame])[0]
         main_mood = get_main_mood(sub_mood)
         return main_mood, sub_mood
     except Exception:
         return "Neutral", "ambient"
+
+# Frame indices spread evenly over a scene, away from the cut itself
+def _scene_sample_frames(start_frame, end_frame, samples_per_scene):
+    length = max(1, end_frame - start_frame)
+    count = max(1, min(samples_per_scene, length))
+    return [start_frame + int((k + 0.5) * length / count) for k in range(count)]
+
+def analyze_video_moods(video_path, samples_per_scene=3, batch_size=16, scenes=None):
+    """
+    Analyze mood across the whole video.
+    Samples frames from every scene, runs them through the model in batches and
+    returns the mood of each scene plus a duration-weighted video-level mood.
+    "inference_failed" is set if any batch fell back to "ambient" votes.
+    """
+    if scenes is None:
+        from scene_detector import split_video
+        scenes = split_video(video_path)
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if not scenes:
+        scenes = [(0.0, frame_count / fps if fps > 0 else 0.0)]
+
+    scene_votes = [Counter() for _ in scenes]
+    pending_frames, pending_scenes = [], []
+    inference_failed = False
+
+    def flush():
+        nonlocal inference_failed
+        try:
+            sub_moods = predict_sub_moods(pending_frames, batch_size)
+        except Exception:
+            logging.exception("Batched mood inference failed")
+            inference_failed = True
+            sub_moods = ["ambient"] * len(pending_frames)
+        for scene_idx, sub_mood in zip(pending_scenes, sub_moods):
+            scene_votes[scene_idx][sub_mood] += 1
+        pending_frames.clear()
+        pending_scenes.clear()
+
+    try:
+        for scene_idx, (start, end) in enumerate(scenes):
+            start_frame = int(start * fps) if fps > 0 else 0
+            end_frame = int(end * fps) if fps > 0 else 1
+            if frame_count > 0:
+                end_frame = min(end_frame, frame_count)
+            for frame_idx in _scene_sample_frames(start_frame, end_frame, samples_per_scene):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                ret, frame = cap.read()
+                if not ret:
+                    continue
+                pending_frames.append(frame)
+                pending_scenes.append(scene_idx)
+                if len(pending_frames) >= batch_size:
+                    flush()
+        if pending_frames:
+            flush()
+    finally:
+        cap.release()
+
+    moods = summarize_scene_votes(scenes, scene_votes)
+    moods["inference_failed"] = inference_failed
+    return moods
+
+def summarize_scene_votes(scenes, scene_votes):
+    """Turn per-scene sub-mood votes into scene moods and a duration-weighted video mood"""
+    scene_moods = []
+    video_votes = Counter()
+    for (start, end), votes in zip(scenes, scene_votes):
+        sub_mood = votes.most_common(1)[0][0] if votes else "ambient"
+        scene_moods.append({
+            "start": start,
+            "end": end,
+            "main_mood": get_main_mood(sub_mood),
+            "sub_mood": sub_mood
+        })
+        # Each sampled frame votes with its share of the scene duration
+        frames_sampled = sum(votes.values())
+        for mood, count in votes.items():
+            video_votes[mood] += (end - start) * count / frames_sampled
+
+    sub_mood = video_votes.most_common(1)[0][0] if video_votes else "ambient"
+    return {
+        "main_mood": get_main_mood(sub_mood),
+        "sub_mood": sub_mood,
+        "scenes": scene_moods
+    }
@@ -1,101 +1,316 @@
 import os
 import logging
-import json
-from collections import Counter
+import glob
+import time
+import shutil
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
 import yt_dlp
+import disk_cache
+import selection_store
 
 load_dotenv()
 logging.basicConfig(filename="debug.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
-YOUTUBE = build("youtube", "v3", developerKey=YOUTUBE_API_KEY)
-SELECTIONS_FILE = "user_selections.json"
 
-def search_youtube_tracks(mood_query, max_results=5):
+# Search result cache: in-process LRU plus an optional on-disk store, both with a TTL
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL_SEC", str(24 * 3600)))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_ON_DISK = os.getenv("SEARCH_CACHE_ON_DISK", "1") == "1"
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_MB", "16")) * 1024 * 1024
+
+_search_cache = OrderedDict()
+_search_in_flight = {}
+_search_stats = Counter()
+_search_cache_lock = threading.Lock()
+
+# What download_youtube_audio keeps on disk; "native" skips the lossy MP3 transcode entirely
+AUDIO_FORMATS = ["native", "wav", "mp3"]
+AUDIO_ACQUISITION_FORMAT = os.getenv("AUDIO_ACQUISITION_FORMAT", "native")
+
+# Downloaded audio cache, keyed by video ID and format
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+_audio_download_locks = {}
+_audio_download_locks_guard = threading.Lock()
+
+# The YouTube client is built on first search and reused afterwards
+_youtube_client = None
+_youtube_client_lock = threading.Lock()
+
+def get_youtube_client():
+    """
+    Return the shared YouTube Data API client, building it on first use.
+    Uses the discovery document bundled with google-api-python-client, so
+    building the client never goes to the network.
+    """
+    global _youtube_client
+    if _youtube_client is None:
+        with _youtube_client_lock:
+            if _youtube_client is None:
+                from googleapiclient.discovery import build
+                _youtube_client = build(
+                    "youtube", "v3",
+                    developerKey=YOUTUBE_API_KEY,
+                    static_discovery=True,
+                    cache_discovery=False
+                )
+    return _youtube_client
+
+def _fetch_youtube_tracks(mood_query, max_results, client):
+    request = client.search().list(
+        part="snippet",
+        maxResults=max_results,
+        q=f"{mood_query} music",
+        type="video",
+        videoCategoryId="10"
+    )
+    response = request.execute()
+    tracks = []
+
+    for item in response.get("items", []):
+        video_id = item["id"]["videoId"]
+        title = item["snippet"]["title"]
+        artist = item["snippet"]["channelTitle"]
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        tracks.append({
+            "name": title,
+            "artist": artist,
+            "url": url,
+            "audio_url": url,
+            "source": "youtube"
+        })
+
+    return tracks
+
+def _normalize_query(mood_query):
+    return " ".join(mood_query.lower().split())
+
+def _search_disk_path(key):
+    return os.path.join(disk_cache.cache_dir("search"), f"{disk_cache.hash_key(*key)}.json")
+
+def _load_search_from_disk(key):
+    entry = disk_cache.read_json(_search_disk_path(key))
+    if entry and entry.get("expires_at", 0) > time.time():
+        return entry["tracks"], entry["expires_at"]
+    return None
+
+def _store_search_on_disk(key, tracks, expires_at):
+    disk_cache.atomic_write_json(_search_disk_path(key), {"expires_at": expires_at, "tracks": tracks})
+    disk_cache.evict_lru(disk_cache.cache_dir("search"), SEARCH_CACHE_MAX_BYTES)
+
+def search_youtube_tracks(mood_query, max_results=5, client=None):
+    """
+    Search YouTube for tracks matching a mood.
+    Results are cached per (normalized query, max_results) in an in-process
+    LRU and optionally on disk, both expiring after SEARCH_CACHE_TTL seconds.
+    Concurrent identical searches share a single upstream request. Failed
+    searches return [] and are not cached.
+    """
+    key = (_normalize_query(mood_query), max_results)
+    with _search_cache_lock:
+        entry = _search_cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            _search_cache.move_to_end(key)
+            _search_stats["hits"] += 1
+            return [dict(track) for track in entry[1]]
+        in_flight = _search_in_flight.get(key)
+        owner = in_flight is None
+        if owner:
+            in_flight = Future()
+            _search_in_flight[key] = in_flight
+        else:
+            _search_stats["coalesced"] += 1
+
+    if not owner:
+        return [dict(track) for track in in_flight.result()]
+
+    tracks = []
     try:
-        request = YOUTUBE.search().list(
-            part="snippet",
-            maxResults=max_results,
-            q=f"{mood_query} music",
-            type="video",
-            videoCategoryId="10"
-        )
-        response = request.execute()
-        tracks = []
+        cached = None
+        if SEARCH_CACHE_ON_DISK:
+            try:
+                cached = _load_search_from_disk(key)
+            except OSError as e:
+                logging.warning(f"Search disk cache unavailable: {e}")
 
-        for item in response.get("items", []):
-            video_id = item["id"]["videoId"]
-            title = item["snippet"]["title"]
-            artist = item["snippet"]["channelTitle"]
-            url = f"https://www.youtube.com/watch?v={video_id}"
-            tracks.append({
-                "name": title,
-                "artist": artist,
-                "url": url,
-                "audio_url": url,
-                "source": "youtube"
-            })
-
-        return tracks
+        if cached is not None:
+            tracks, expires_at = cached
+            with _search_cache_lock:
+                _search_stats["disk_hits"] += 1
+        else:
+            with _search_cache_lock:
+                _search_stats["misses"] += 1
+            tracks = _fetch_youtube_tracks(key[0], max_results, client or get_youtube_client())
+            expires_at = time.time() + SEARCH_CACHE_TTL
+            if SEARCH_CACHE_ON_DISK:
+                try:
+                    _store_search_on_disk(key, tracks, expires_at)
+                except OSError as e:
+                    logging.warning(f"Failed to store search results on disk: {e}")
+
+        with _search_cache_lock:
+            _search_cache[key] = (expires_at, tracks)
+            _search_cache.move_to_end(key)
+            while len(_search_cache) > SEARCH_CACHE_SIZE:
+                _search_cache.popitem(last=False)
     except Exception as e:
         logging.error(f"YouTube API search failed: {str(e)}")
-        return []
+        tracks = []
+    finally:
+        in_flight.set_result(tracks)
+        with _search_cache_lock:
+            _search_in_flight.pop(key, None)
+
+    return [dict(track) for track in tracks]
+
+def get_search_cache_stats():
+    """Hit/miss counters for the search cache"""
+    with _search_cache_lock:
+        return {
+            "hits": _search_stats["hits"],
+            "disk_hits": _search_stats["disk_hits"],
+            "misses": _search_stats["misses"],
+            "coalesced": _search_stats["coalesced"],
+            "entries": len(_search_cache)
+        }
+
+def clear_search_cache():
+    """Drop in-process search results and reset the counters (disk entries expire on their own)"""
+    with _search_cache_lock:
+        _search_cache.clear()
+        _search_stats.clear()
 
-def download_youtube_audio(youtube_url, output_path):
+def download_youtube_audio(youtube_url, output_path, audio_format="mp3"):
+    """
+    Download a track's audio with yt_dlp.
+    audio_format picks what ends up on disk:
+      "mp3"    - transcoded to 192k MP3 (the original behaviour)
+      "wav"    - decoded once to PCM WAV, no lossy re-encode
+      "native" - the bestaudio stream as served (webm/opus, m4a, ...), untouched
+    The extension of output_path is replaced by the real one. Returns the path
+    of the downloaded file, or None on failure.
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format: {audio_format}")
+    base_path = os.path.splitext(output_path)[0]
     try:
         ydl_opts = {
             'format': 'bestaudio/best',
-            'outtmpl': output_path,
+            # yt_dlp fills in the extension; postprocessors then swap it for their own
+            'outtmpl': f"{base_path}.%(ext)s",
             'quiet': True,
             'nocheckcertificate': True,
-            'postprocessors': [{
+            # Keep the download time as mtime; the audio cache evicts by it
+            'updatetime': False,
+        }
+        if audio_format != "native":
+            ydl_opts['postprocessors'] = [{
                 'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
+                'preferredcodec': audio_format,
                 'preferredquality': '192',
-            }],
-            'postprocessor_args': [
+            }]
+            ydl_opts['postprocessor_args'] = [
                 '-fflags', '+genpts',
                 '-loglevel', 'error'
             ]
-        }
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_url])
-        return os.path.exists(output_path)
+            info = ydl.extract_info(youtube_url, download=True)
+
+        downloaded = [d.get("filepath") for d in (info or {}).get("requested_downloads", [])]
+        downloaded = [path for path in downloaded if path and os.path.exists(path)]
+        if not downloaded:
+            # Older yt_dlp versions don't report the final path
+            downloaded = glob.glob(f"{glob.escape(base_path)}.*")
+        if not downloaded:
+            logging.error(f"yt_dlp reported success but no audio file was written for {youtube_url}")
+            return None
+        return downloaded[0]
     except Exception as e:
         logging.error(f"yt_dlp failed to download or extract audio: {e}")
-        return False
+        return None
 
-def log_user_selection(mood, track):
-    try:
-        if os.path.exists(SELECTIONS_FILE):
-            with open(SELECTIONS_FILE, "r") as f:
-                data = json.load(f)
-        else:
-            data = {"mood_history": {}}
+def youtube_video_id(youtube_url):
+    """Extract the video ID from the usual YouTube URL shapes"""
+    parsed = urlparse(youtube_url)
+    if parsed.hostname and parsed.hostname.endswith("youtu.be"):
+        return parsed.path.lstrip("/").split("/")[0] or None
+    video_ids = parse_qs(parsed.query).get("v")
+    if video_ids:
+        return video_ids[0]
+    parts = [part for part in parsed.path.split("/") if part]
+    if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+        return parts[1]
+    return None
+
+def _audio_cache_base(youtube_url, audio_format):
+    # Cache entries are "<video id>-<format>.<real extension>"; unrecognized URLs still get a stable key
+    video_id = youtube_video_id(youtube_url) or disk_cache.hash_key(youtube_url)
+    return os.path.join(disk_cache.cache_dir("audio"), f"{video_id}-{audio_format}")
+
+def get_cached_audio(youtube_url, audio_format=None):
+    """Local path of already downloaded audio for a URL, or None"""
+    audio_format = audio_format or AUDIO_ACQUISITION_FORMAT
+    matches = glob.glob(f"{glob.escape(_audio_cache_base(youtube_url, audio_format))}.*")
+    if matches:
+        disk_cache.touch(matches[0])
+        return matches[0]
+    return None
 
-        mood_history = data.get("mood_history", {})
-        mood_history.setdefault(mood, [])
-        mood_history[mood].append(track["name"])
-        data["mood_history"] = mood_history
+def fetch_youtube_audio(youtube_url, audio_format=None):
+    """
+    Local path of the audio for a YouTube URL, downloading it into the cache on a miss.
+    Downloads land in a private temp directory inside the cache and are renamed
+    into place, so other processes never see a half-written file. Returns None
+    if the download fails.
+    """
+    audio_format = audio_format or AUDIO_ACQUISITION_FORMAT
+    cached = get_cached_audio(youtube_url, audio_format)
+    if cached:
+        logging.info(f"Audio cache hit for {youtube_url}")
+        return cached
 
-        with open(SELECTIONS_FILE, "w") as f:
-            json.dump(data, f, indent=4)
+    base_path = _audio_cache_base(youtube_url, audio_format)
+    with _audio_download_locks_guard:
+        lock = _audio_download_locks.setdefault(base_path, threading.Lock())
+    with lock:
+        # Another thread may have finished the same download while we waited
+        cached = get_cached_audio(youtube_url, audio_format)
+        if cached:
+            return cached
+        directory = disk_cache.cache_dir("audio")
+        tmp_dir = tempfile.mkdtemp(dir=directory, prefix=".tmp")
+        try:
+            downloaded = download_youtube_audio(youtube_url, os.path.join(tmp_dir, "audio"), audio_format)
+            if not downloaded:
+                return None
+            path = base_path + os.path.splitext(downloaded)[1]
+            os.replace(downloaded, path)
+            disk_cache.touch(path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    disk_cache.evict_lru(directory, AUDIO_CACHE_MAX_BYTES)
+    return path if os.path.exists(path) else None
+
+def log_user_selection(mood, track):
+    try:
+        selection_store.log_selection(mood, track["name"])
     except Exception as e:
         logging.error(f"Failed to log user selection: {str(e)}")
 
-def get_preferred_track_name(mood):
+def get_preferred_tracks(mood, limit=5):
+    """Most often selected track names for a mood, most popular first"""
     try:
-        if not os.path.exists(SELECTIONS_FILE):
-            return None
-        with open(SELECTIONS_FILE, "r") as f:
-            data = json.load(f)
-        mood_list = data.get("mood_history", {}).get(mood, [])
-        if not mood_list:
-            return None
-        most_common = Counter(mood_list).most_common(1)
-        return most_common[0][0] if most_common else None
+        return [track_name for track_name, _ in selection_store.top_tracks(mood, limit)]
     except Exception as e:
-        logging.error(f"Failed to get preferred track: {str(e)}")
-        return None
+        logging.error(f"Failed to get preferred tracks: {str(e)}")
+        return []
+
+def get_preferred_track_name(mood):
+    preferred = get_preferred_tracks(mood, limit=1)
+    return preferred[0] if preferred else None
@@ -1,15 +1,145 @@
-from scenedetect import VideoManager, SceneManager
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from scenedetect import open_video, SceneManager
 from scenedetect.detectors import ContentDetector
+from scenedetect.scene_manager import compute_downscale_factor
 
-def split_video(video_path, threshold=30.0, min_scene_len=15):
-    video_manager = VideoManager([video_path])
+# Worker processes for scene detection; 1 keeps the single-threaded PySceneDetect path
+SCENE_DETECTION_WORKERS = int(os.getenv("SCENE_DETECTION_WORKERS", "1"))
+
+# Speed/accuracy presets:
+#   frame_skip       - frames skipped between detector calls
+#   downscale_width  - width frames are shrunk to before detection (None = PySceneDetect's automatic choice)
+#   refine           - re-check each coarse cut at full detection resolution to recover its exact frame
+SCENE_DETECTION_MODES = {
+    "accurate": {"frame_skip": 0, "downscale_width": None, "refine": False},
+    "balanced": {"frame_skip": 1, "downscale_width": 320, "refine": True},
+    "fast": {"frame_skip": 3, "downscale_width": 160, "refine": True},
+}
+SCENE_DETECTION_MODE = os.getenv("SCENE_DETECTION_MODE", "accurate")
+
+# Length of the time window each worker handles, and the frames it decodes before its window
+PARALLEL_WINDOW_SEC = 60.0
+WINDOW_PREROLL_FRAMES = 2
+
+def split_video(video_path, threshold=30.0, min_scene_len=15, workers=None, mode=None):
+    workers = SCENE_DETECTION_WORKERS if workers is None else workers
+    if workers > 1:
+        return split_video_parallel(video_path, threshold, min_scene_len, workers)
+
+    settings = SCENE_DETECTION_MODES[mode or SCENE_DETECTION_MODE]
+    video = open_video(video_path)
     scene_manager = SceneManager()
     scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_scene_len))
+    if settings["downscale_width"]:
+        scene_manager.auto_downscale = False
+        scene_manager.downscale = max(1, round(video.frame_size[0] / settings["downscale_width"]))
+    scene_manager.detect_scenes(video=video, frame_skip=settings["frame_skip"])
+
+    scene_list = scene_manager.get_scene_list()
+    if not scene_list:
+        return []
+    fps = video.frame_rate
+    cuts = [scene[0].get_frames() for scene in scene_list[1:]]
+    total_frames = scene_list[-1][1].get_frames()
+
+    if settings["refine"] and settings["frame_skip"] > 0:
+        cuts = refine_cuts(video_path, cuts, threshold, min_scene_len, settings["frame_skip"])
+
+    boundaries = [0] + cuts + [total_frames]
+    return [(boundaries[i] / fps, boundaries[i + 1] / fps) for i in range(len(boundaries) - 1)]
+
+def refine_cuts(video_path, coarse_cuts, threshold, min_scene_len, frame_skip):
+    """
+    Pin down coarse cuts found with frame skipping.
+    A cut reported at frame c happened somewhere in the skipped frames before
+    it, so only that short range is decoded again at the default detection
+    resolution; the rest of the video is never touched a second time.
+    """
+    refined = []
+    for cut in coarse_cuts:
+        candidates, _ = _detect_window((video_path, threshold, max(0, cut - frame_skip), cut + 1))
+        # The first frame over the threshold is the one a full-rate pass would have reported
+        refined.append(min(candidates) if candidates else cut)
+    return merge_window_cuts([refined], min_scene_len)
+
+def _detect_window(args):
+    """
+    Candidate cuts in frames [owned_start, owned_end) of one window.
+    Runs with min_scene_len=0 so every frame over the threshold is reported;
+    min_scene_len is applied once over the merged list so the result doesn't
+    depend on where the windows were split. Decoding starts a few frames early
+    because the content score of a frame needs the frame before it.
+    """
+    video_path, threshold, owned_start, owned_end = args
+    cap = cv2.VideoCapture(video_path)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        downscale = compute_downscale_factor(width) if width > 0 else 1
+        size = (max(1, round(width / downscale)), max(1, round(height / downscale)))
+
+        decode_start = max(0, owned_start - WINDOW_PREROLL_FRAMES)
+        if decode_start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, decode_start)
+        frame_num = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+        detector = ContentDetector(threshold=threshold, min_scene_len=0)
+        cuts = []
+        while owned_end is None or frame_num < owned_end:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if downscale > 1:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+            for cut in detector.process_frame(frame_num, frame):
+                if cut >= owned_start:
+                    cuts.append(cut)
+            frame_num += 1
+        return cuts, frame_num
+    finally:
+        cap.release()
+
+def merge_window_cuts(window_cuts, min_scene_len):
+    """Merge per-window candidate cuts, dropping duplicates and cuts closer than min_scene_len"""
+    merged = []
+    last_cut = 0
+    for cut in sorted(set(cut for cuts in window_cuts for cut in cuts)):
+        if cut - last_cut >= min_scene_len:
+            merged.append(cut)
+            last_cut = cut
+    return merged
+
+def split_video_parallel(video_path, threshold=30.0, min_scene_len=15, workers=None, window_sec=PARALLEL_WINDOW_SEC):
+    """
+    Scene detection over time windows processed in parallel.
+    Returns the same (start_sec, end_sec) list as split_video.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    window_frames = int(window_sec * fps) if fps > 0 else 0
+    if window_frames <= 0 or frame_count <= window_frames:
+        return split_video(video_path, threshold, min_scene_len, workers=1, mode="accurate")
 
-    base_timecode = video_manager.get_base_timecode()
-    video_manager.set_downscale_factor()
-    video_manager.start()
-    scene_manager.detect_scenes(frame_source=video_manager)
+    # The last window reads to the end of the stream, since the header frame count can be off
+    starts = list(range(0, frame_count, window_frames))
+    windows = [
+        (video_path, threshold, start, starts[i + 1] if i + 1 < len(starts) else None)
+        for i, start in enumerate(starts)
+    ]
+    workers = workers or os.cpu_count() or 1
+    logging.info(f"Detecting scenes in {len(windows)} windows with {workers} workers")
+    with ProcessPoolExecutor(max_workers=min(workers, len(windows))) as executor:
+        results = list(executor.map(_detect_window, windows))
 
-    scene_list = scene_manager.get_scene_list(base_timecode)
-    return [(scene[0].get_seconds(), scene[1].get_seconds()) for scene in scene_list]
+    cuts = merge_window_cuts([window_result[0] for window_result in results], min_scene_len)
+    if not cuts:
+        return []
+    total_frames = max(window_result[1] for window_result in results)
+    boundaries = [0] + cuts + [total_frames]
+    return [(boundaries[i] / fps, boundaries[i + 1] / fps) for i in range(len(boundaries) - 1)]
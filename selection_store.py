@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+# Append-only selection log plus per-mood counts kept up to date on every write
+SELECTIONS_DB = os.getenv("SELECTIONS_DB", "user_selections.db")
+LEGACY_SELECTIONS_FILE = "user_selections.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS selections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mood TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    selected_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS track_counts (
+    mood TEXT NOT NULL,
+    track_name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_selection INTEGER NOT NULL,
+    PRIMARY KEY (mood, track_name)
+);
+CREATE INDEX IF NOT EXISTS track_counts_by_rank ON track_counts (mood, count DESC, first_selection);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# sqlite3 connections can't be shared across threads, so each thread opens its own
+_local = threading.local()
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SELECTIONS_DB, timeout=10, isolation_level=None)
+        # WAL lets readers proceed while another process is writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _migrate_legacy_json(conn)
+        _local.conn = conn
+    return conn
+
+def _insert_selection(conn, mood, track_name, selected_at):
+    cursor = conn.execute(
+        "INSERT INTO selections (mood, track_name, selected_at) VALUES (?, ?, ?)",
+        (mood, track_name, selected_at)
+    )
+    conn.execute(
+        """INSERT INTO track_counts (mood, track_name, count, first_selection) VALUES (?, ?, 1, ?)
+           ON CONFLICT (mood, track_name) DO UPDATE SET count = count + 1""",
+        (mood, track_name, cursor.lastrowid)
+    )
+
+def _migrate_legacy_json(conn):
+    """One-time import of the old user_selections.json history, preserving selection order"""
+    if not os.path.exists(LEGACY_SELECTIONS_FILE):
+        return
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_migrated'").fetchone():
+        return
+    # BEGIN IMMEDIATE takes the write lock, so only one process performs the import
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_migrated'").fetchone():
+            conn.execute("ROLLBACK")
+            return
+        with open(LEGACY_SELECTIONS_FILE, "r") as f:
+            data = json.load(f)
+        migrated = 0
+        for mood, track_names in data.get("mood_history", {}).items():
+            for track_name in track_names:
+                _insert_selection(conn, mood, track_name, 0.0)
+                migrated += 1
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_json_migrated', ?)", (str(time.time()),))
+        conn.execute("COMMIT")
+        logging.info(f"Migrated {migrated} selections from {LEGACY_SELECTIONS_FILE}")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def log_selection(mood, track_name):
+    """Record one selection and bump the mood's count for the track in the same transaction"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _insert_selection(conn, mood, track_name, time.time())
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def top_tracks(mood, limit=1):
+    """
+    Most selected track names for a mood, most popular first.
+    Ties go to the track that was selected first. Served from the
+    (mood, count) index, so the cost doesn't grow with the history size.
+    """
+    rows = _connect().execute(
+        "SELECT track_name, count FROM track_counts WHERE mood = ? "
+        "ORDER BY count DESC, first_selection LIMIT ?",
+        (mood, limit)
+    ).fetchall()
+    return [(track_name, count) for track_name, count in rows]
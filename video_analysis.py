@@ -0,0 +1,227 @@
+import os
+import logging
+from collections import Counter
+import cv2
+from scenedetect.detectors import ContentDetector
+from scenedetect.scene_manager import compute_downscale_factor
+import disk_cache
+import mood_analyzer
+import scene_detector
+from mood_analyzer import analyze_video_moods
+from scene_detector import split_video
+
+# Analysis results are small JSON documents; this bounds the whole cache
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# "single_pass" decodes the video once; "multi_pass" runs scene detection and mood sampling separately
+ANALYSIS_PIPELINE = os.getenv("ANALYSIS_PIPELINE", "single_pass")
+
+# Mood candidate frames kept per scene while decoding; halved (and the stride doubled) when exceeded
+MAX_SCENE_CANDIDATES = 16
+
+def get_video_duration(video_path):
+    """Get video duration in seconds"""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    duration = frame_count / fps if fps > 0 else 0
+    cap.release()
+    return duration
+
+def analysis_pipeline():
+    """
+    The pipeline analyze_video runs: "single_pass", "parallel" or "multi_pass:<mode>".
+    The single pass has its own full-rate detector, so parallel scene
+    detection (SCENE_DETECTION_WORKERS > 1) or a SCENE_DETECTION_MODE other
+    than "accurate" sends it through scene_detector.split_video instead.
+    Parallel detection doesn't use the mode presets.
+    """
+    if scene_detector.SCENE_DETECTION_WORKERS > 1:
+        return "parallel"
+    if ANALYSIS_PIPELINE == "single_pass" and scene_detector.SCENE_DETECTION_MODE == "accurate":
+        return "single_pass"
+    return f"multi_pass:{scene_detector.SCENE_DETECTION_MODE}"
+
+def analysis_cache_key(video_path, threshold, min_scene_len, samples_per_scene, pipeline):
+    """Cache key: video content plus every parameter that affects the result"""
+    return disk_cache.hash_key(
+        disk_cache.file_fingerprint(video_path),
+        threshold,
+        min_scene_len,
+        samples_per_scene,
+        mood_analyzer.MODEL_VERSION,
+        mood_analyzer.MOOD_BACKEND,
+        pipeline
+    )
+
+# Pick the buffered candidates closest to evenly spaced positions inside a scene
+def _pick_scene_samples(candidates, start_frame, end_frame, samples_per_scene):
+    if not candidates:
+        return []
+    length = max(1, end_frame - start_frame)
+    picked = []
+    for k in range(samples_per_scene):
+        target = start_frame + (k + 0.5) * length / samples_per_scene
+        best = min(range(len(candidates)), key=lambda i: abs(candidates[i][0] - target))
+        if best not in picked:
+            picked.append(best)
+    return [candidates[i][1] for i in picked]
+
+def analyze_video_single_pass(video_path, threshold=30.0, min_scene_len=15, samples_per_scene=3, batch_size=16):
+    """
+    Scene detection, mood sampling and duration from a single decode of the video.
+    Every frame is fed to the ContentDetector, while a thinned set of 224x224
+    candidate frames is buffered for the current scene so mood samples can be
+    picked at scene-relative positions as soon as the scene's cut is known.
+    Returns None if the video can't be decoded this way.
+    "inference_failed" is set if any batch fell back to "ambient" votes.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not cap.isOpened() or fps <= 0:
+        cap.release()
+        return None
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    downscale = compute_downscale_factor(width) if width > 0 else 1
+    detector_size = (max(1, round(width / downscale)), max(1, round(height / downscale)))
+    detector = ContentDetector(threshold=threshold, min_scene_len=min_scene_len)
+
+    cut_frames = []
+    scene_votes = []
+    pending_frames, pending_scenes = [], []
+    candidates = []
+    stride = 1
+    scene_start = 0
+    frame_num = 0
+    inference_failed = False
+
+    def flush():
+        nonlocal inference_failed
+        try:
+            sub_moods = mood_analyzer.to_sub_moods(
+                mood_analyzer.predict_resized_class_indices(pending_frames, batch_size)
+            )
+        except Exception:
+            logging.exception("Batched mood inference failed")
+            inference_failed = True
+            sub_moods = ["ambient"] * len(pending_frames)
+        for scene_idx, sub_mood in zip(pending_scenes, sub_moods):
+            scene_votes[scene_idx][sub_mood] += 1
+        pending_frames.clear()
+        pending_scenes.clear()
+
+    def close_scene(end_frame):
+        nonlocal candidates, stride, scene_start
+        scene_candidates = [c for c in candidates if c[0] < end_frame]
+        candidates = [c for c in candidates if c[0] >= end_frame]
+        scene_votes.append(Counter())
+        for resized in _pick_scene_samples(scene_candidates, scene_start, end_frame, samples_per_scene):
+            pending_frames.append(resized)
+            pending_scenes.append(len(scene_votes) - 1)
+        if len(pending_frames) >= batch_size:
+            flush()
+        scene_start = end_frame
+        stride = 1
+
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            small = frame if downscale == 1 else cv2.resize(frame, detector_size, interpolation=cv2.INTER_LINEAR)
+            for cut in detector.process_frame(frame_num, small):
+                cut_frames.append(cut)
+                close_scene(cut)
+
+            if (frame_num - scene_start) % stride == 0:
+                candidates.append((frame_num, mood_analyzer.resize_frames([frame])[0]))
+                if len(candidates) > MAX_SCENE_CANDIDATES:
+                    candidates = candidates[::2]
+                    stride *= 2
+            frame_num += 1
+
+        for cut in detector.post_process(frame_num):
+            cut_frames.append(cut)
+            close_scene(cut)
+        close_scene(frame_num)
+        if pending_frames:
+            flush()
+    finally:
+        cap.release()
+
+    # Same contract as split_video: no cuts means no scene list
+    scenes = []
+    if cut_frames:
+        boundaries = [0] + cut_frames + [frame_num]
+        scenes = [(boundaries[i] / fps, boundaries[i + 1] / fps) for i in range(len(boundaries) - 1)]
+
+    duration = frame_num / fps
+    moods = mood_analyzer.summarize_scene_votes(scenes or [(0.0, duration)], scene_votes)
+    return {
+        "scenes": scenes,
+        "scene_moods": moods["scenes"],
+        "main_mood": moods["main_mood"],
+        "sub_mood": moods["sub_mood"],
+        "duration": duration,
+        "inference_failed": inference_failed
+    }
+
+def analyze_video_multi_pass(video_path, threshold=30.0, min_scene_len=15, samples_per_scene=3):
+    """Scene detection, mood sampling and duration as separate passes over the file"""
+    scenes = split_video(video_path, threshold=threshold, min_scene_len=min_scene_len)
+    moods = analyze_video_moods(video_path, samples_per_scene=samples_per_scene, scenes=scenes)
+    return {
+        "scenes": scenes,
+        "scene_moods": moods["scenes"],
+        "main_mood": moods["main_mood"],
+        "sub_mood": moods["sub_mood"],
+        "duration": get_video_duration(video_path),
+        "inference_failed": moods["inference_failed"]
+    }
+
+def _cache_path(key):
+    return os.path.join(disk_cache.cache_dir("analysis"), f"{key}.json")
+
+def analyze_video(video_path, threshold=30.0, min_scene_len=15, samples_per_scene=3, use_cache=True):
+    """
+    Scene boundaries, per-scene moods and duration for a video.
+    Results are cached on disk by content hash, so re-uploading the same clip
+    with the same settings skips scene detection and inference entirely.
+    """
+    pipeline = analysis_pipeline()
+    key = None
+    if use_cache:
+        try:
+            key = analysis_cache_key(video_path, threshold, min_scene_len, samples_per_scene, pipeline)
+            cached = disk_cache.read_json(_cache_path(key))
+            if cached is not None:
+                logging.info(f"Analysis cache hit for {video_path}")
+                cached["scenes"] = [tuple(scene) for scene in cached["scenes"]]
+                return cached
+        except OSError as e:
+            logging.warning(f"Analysis cache unavailable: {e}")
+            key = None
+
+    result = None
+    if pipeline == "single_pass":
+        result = analyze_video_single_pass(video_path, threshold, min_scene_len, samples_per_scene)
+        if result is None:
+            logging.warning(f"Single-pass analysis unavailable for {video_path}, falling back to multi-pass")
+    elif ANALYSIS_PIPELINE == "single_pass":
+        logging.info(f"Scene detection settings need split_video; analyzing {video_path} with the {pipeline} pipeline")
+    if result is None:
+        result = analyze_video_multi_pass(video_path, threshold, min_scene_len, samples_per_scene)
+
+    # Fallback "ambient" votes from a failed batch would otherwise be served from disk forever
+    if result.pop("inference_failed", False):
+        logging.warning(f"Mood inference failed for part of {video_path}; not caching this analysis")
+        key = None
+    if key is not None:
+        try:
+            disk_cache.atomic_write_json(_cache_path(key), result)
+            disk_cache.evict_lru(disk_cache.cache_dir("analysis"), ANALYSIS_CACHE_MAX_BYTES)
+        except OSError as e:
+            logging.warning(f"Failed to store analysis in cache: {e}")
+    return result
@@ -1,17 +1,95 @@
 # video_editor.py - Enhanced Version with Fixed Audio Effects
 import os
+import time
 import tempfile
 import logging
+import shutil
+import subprocess
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 from pydub import AudioSegment
 from pydub.effects import normalize, compress_dynamic_range
-from moviepy.editor import VideoFileClip, AudioFileClip, CompositeAudioClip
-from music_matcher import download_youtube_audio
+from pydub.utils import mediainfo_json
+from moviepy.editor import VideoFileClip
+from moviepy.audio.AudioClip import AudioArrayClip
+from music_matcher import fetch_youtube_audio, AUDIO_ACQUISITION_FORMAT
+import disk_cache
+import audio_dsp
+import audio_stream
 
 logging.basicConfig(filename="debug.log", level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# "numpy" runs echo/reverb as float32 array DSP; "pydub" keeps the original overlay-based versions
+AUDIO_DSP_ENGINE = os.getenv("AUDIO_DSP_ENGINE", "numpy")
+
+# Threads used to download/decode distinct tracks before rendering
+PREFETCH_WORKERS = int(os.getenv("AUDIO_PREFETCH_WORKERS", "4"))
+
+# Integrated loudness (BS.1770 LUFS) every processed segment is normalized to by the numpy engine
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-16"))
+
+# Worker processes for segment effects; 1 processes segments one after another in this process
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "1"))
+
+# "remux" muxes the new audio with the source video stream copied as is, "x264" re-encodes the video
+# through MoviePy, and "auto" remuxes whenever the output container can carry the source codec
+RENDER_MODES = ["auto", "remux", "x264"]
+RENDER_MODE = os.getenv("RENDER_MODE", "auto")
+
+# Video codecs each output container can take by stream copy (None: any codec)
+REMUX_VIDEO_CODECS = {
+    ".mp4": {"h264", "hevc", "mpeg4", "av1", "vp9"},
+    ".m4v": {"h264", "hevc", "mpeg4"},
+    ".mov": {"h264", "hevc", "mpeg4", "prores", "mjpeg"},
+    ".mkv": None,
+}
+
+# Mix levels for the music and the original soundtrack underneath it; music over a silent video plays at full level
+MUSIC_GAIN = 0.8
+ORIGINAL_AUDIO_GAIN = 0.3
+
+# Equal-power crossfade where one segment ends exactly where the next starts; 0 keeps hard cuts
+SEGMENT_CROSSFADE_MS = int(os.getenv("SEGMENT_CROSSFADE_MS", "0"))
+
+# "memory" decodes whole tracks and keeps each segment in RAM; "streaming" decodes only each
+# segment's music window and processes it block by block through disk-backed buffers, so memory
+# use stays flat however long the video and tracks are (numpy engine only)
+AUDIO_PROCESSING_MODES = ["memory", "streaming"]
+AUDIO_PROCESSING_MODE = os.getenv("AUDIO_PROCESSING_MODE", "memory")
+
+# Processed segments are cached on disk, so a re-render only redoes segments whose inputs changed
+SEGMENT_CACHE = os.getenv("SEGMENT_CACHE", "1") == "1"
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# Part of every segment cache key; bump it whenever a DSP change alters processed audio
+SEGMENT_ENGINE_VERSION = "1"
+
+# Preview renders: only the chosen time range or the seams between segments, small and quick to encode
+PREVIEW_SEAM_PADDING_SEC = 3.0
+PREVIEW_HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "360"))
+PREVIEW_VIDEO_KBPS = int(os.getenv("PREVIEW_VIDEO_KBPS", "800"))
+PREVIEW_PRESET = "ultrafast"
+PREVIEW_AUDIO_RATE = int(os.getenv("PREVIEW_AUDIO_RATE", "22050"))
+PREVIEW_AUDIO_BITRATE = "96k"
+
+# Every track is decoded to this rate and layout, and segments stay in memory at it until the mix
+RENDER_FRAME_RATE = int(os.getenv("RENDER_AUDIO_RATE", "44100"))
+RENDER_CHANNELS = 2
+
 def create_echo_effect(audio_segment, delay_ms=300, decay_factor=0.5, num_echoes=3):
     """Create a proper echo effect with multiple delayed repetitions"""
+    if AUDIO_DSP_ENGINE == "pydub":
+        return create_echo_effect_pydub(audio_segment, delay_ms, decay_factor, num_echoes)
+    try:
+        samples = audio_dsp.echo(audio_dsp.segment_to_array(audio_segment), audio_segment.frame_rate,
+                                 delay_ms, decay_factor, num_echoes)
+        return audio_dsp.array_to_segment(samples, audio_segment.frame_rate, audio_segment.sample_width)
+    except Exception as e:
+        logging.error(f"Echo effect failed: {e}")
+        return audio_segment
+
+def create_echo_effect_pydub(audio_segment, delay_ms=300, decay_factor=0.5, num_echoes=3):
+    """Reference echo built from pydub overlays (one full-length copy per echo)"""
     try:
         result = audio_segment
         
@@ -59,33 +137,9 @@ def create_pitch_shift(audio_segment, shift_factor):
 def create_volume_ramp(audio_segment, start_gain_db, end_gain_db, duration_ms):
     """Create smooth volume ramp effect"""
     try:
-        # Create gain curve
-        samples = len(audio_segment.get_array_of_samples())
-        
-        if audio_segment.channels == 2:
-            samples = samples // 2
-        
-        # Create linear interpolation for gain
-        gain_curve = np.linspace(start_gain_db, end_gain_db, samples)
-        
-        # Convert to linear scale (from dB)
-        linear_curve = np.power(10, gain_curve / 20)
-        
-        # Apply gain curve
-        audio_array = np.array(audio_segment.get_array_of_samples())
-        
-        if audio_segment.channels == 2:
-            # Stereo
-            audio_array = audio_array.reshape((-1, 2))
-            audio_array = audio_array * linear_curve.reshape((-1, 1))
-            audio_array = audio_array.flatten()
-        else:
-            # Mono
-            audio_array = audio_array * linear_curve
-        
-        # Convert back to AudioSegment
-        audio_array = audio_array.astype(np.int16)
-        return audio_segment._spawn(audio_array.tobytes())
+        # Works in float32, so any sample width is handled and the result is clipped rather than wrapped
+        samples = audio_dsp.volume_ramp(audio_dsp.segment_to_array(audio_segment), start_gain_db, end_gain_db)
+        return audio_dsp.array_to_segment(samples, audio_segment.frame_rate, audio_segment.sample_width)
     
     except Exception as e:
         logging.error(f"Volume ramp failed: {e}")
@@ -96,7 +150,19 @@ def create_volume_ramp(audio_segment, start_gain_db, end_gain_db, duration_ms):
             return audio_segment.fade_out(duration_ms // 2)
 
 def create_reverb_effect(audio_segment, room_size=0.5, damping=0.5, wet_level=0.3):
-    """Create a simple reverb effect using multiple delayed echoes"""
+    """Create a reverb effect by convolving with a generated impulse response"""
+    if AUDIO_DSP_ENGINE == "pydub":
+        return create_reverb_effect_pydub(audio_segment, room_size, damping, wet_level)
+    try:
+        samples = audio_dsp.reverb(audio_dsp.segment_to_array(audio_segment), audio_segment.frame_rate,
+                                   room_size, damping, wet_level)
+        return audio_dsp.array_to_segment(samples, audio_segment.frame_rate, audio_segment.sample_width)
+    except Exception as e:
+        logging.error(f"Reverb effect failed: {e}")
+        return audio_segment
+
+def create_reverb_effect_pydub(audio_segment, room_size=0.5, damping=0.5, wet_level=0.3):
+    """Reference reverb using multiple delayed echoes built from pydub overlays"""
     try:
         # Create multiple short echoes to simulate reverb
         reverb_delays = [50, 75, 125, 150, 200, 250, 300, 375, 450]
@@ -130,104 +196,333 @@ def create_reverb_effect(audio_segment, room_size=0.5, damping=0.5, wet_level=0.
         logging.error(f"Reverb effect failed: {e}")
         return audio_segment
 
-def apply_audio_effects(audio_path, output_path, effects_list, duration_ms, music_start_ms=0, music_end_ms=None):
-    """Apply audio effects to a segment with proper timing controls and enhanced effects"""
+def track_key(track):
+    """Identity of a track's audio source, shared by every segment that uses it"""
+    if track.get("source") == "youtube":
+        return ("youtube", track.get("audio_url"))
+    if track.get("source") == "local":
+        return ("local", track.get("path"))
+    return (track.get("source", "unknown"), track.get("name"))
+
+def track_identity(track):
+    """
+    What a track's decoded audio depends on, for cache keys: a local file's
+    content (uploads land at a new temp path every session) or the URL and
+    download format.
+    """
+    if track.get("source") == "local" and track.get("path") and os.path.exists(track["path"]):
+        return ("local", disk_cache.file_fingerprint(track["path"]))
+    if track.get("source") == "youtube":
+        return ("youtube", track.get("audio_url"), AUDIO_ACQUISITION_FORMAT)
+    return track_key(track)
+
+def _fetch_track_path(track):
+    """Local path of a track's audio, downloading it if remote; raises on failure"""
+    if track["source"] == "youtube":
+        path = fetch_youtube_audio(track["audio_url"])
+        if path is None:
+            raise RuntimeError("download failed")
+    elif track["source"] == "local":
+        path = track["path"]
+    else:
+        raise ValueError(f"unknown source type: {track.get('source', 'unknown')}")
+    return path
+
+def _fetch_track_audio(track, frame_rate=None):
+    """Fetch (if remote) and decode one track to a float32 array at frame_rate (RENDER_FRAME_RATE); raises on failure"""
+    return audio_dsp.decode_audio(_fetch_track_path(track), frame_rate or RENDER_FRAME_RATE, RENDER_CHANNELS)
+
+def prefetch_tracks(scene_assignments, max_workers=None, decode=True, frame_rate=None):
+    """
+    Fetch and decode every distinct track used by the assignments concurrently.
+    Returns (audio_by_key, errors_by_key), both keyed by track_key. A track
+    that fails only lands in the errors dict; the others are unaffected.
+    With decode=False the tracks are only fetched, and local paths are returned.
+    """
+    tracks = {}
+    for assignment in scene_assignments.values():
+        tracks.setdefault(track_key(assignment["track"]), assignment["track"])
+
+    audio_by_key, errors_by_key = {}, {}
+    if not tracks:
+        return audio_by_key, errors_by_key
+
+    workers = min(max_workers or PREFETCH_WORKERS, len(tracks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetch = (lambda track: _fetch_track_audio(track, frame_rate)) if decode else _fetch_track_path
+        futures = {executor.submit(fetch, track): key for key, track in tracks.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                audio_by_key[key] = future.result()
+                logging.info(f"Prefetched {tracks[key]['name']}")
+            except Exception as e:
+                errors_by_key[key] = str(e)
+                logging.warning(f"Failed to prefetch {tracks[key]['name']}: {e}")
+    return audio_by_key, errors_by_key
+
+def resolve_music_window(audio_length_ms, duration_ms, music_start_ms=0, music_end_ms=None):
+    """Clamp the requested [start, end) portion of a track to what the track actually has"""
+    if music_end_ms is None:
+        music_end_ms = audio_length_ms
+
+    # Ensure we don't exceed the audio file length
+    music_start_ms = min(music_start_ms, audio_length_ms)
+    music_end_ms = min(music_end_ms, audio_length_ms)
+
+    if music_start_ms >= music_end_ms:
+        logging.warning(f"Invalid music timing: start {music_start_ms}ms >= end {music_end_ms}ms")
+        music_start_ms = 0
+        music_end_ms = min(duration_ms, audio_length_ms)
+    return music_start_ms, music_end_ms
+
+def segment_window(samples, frame_rate, duration_ms, music_start_ms=0, music_end_ms=None):
+    """The [music_start_ms, music_end_ms) part of a decoded track, as a view"""
+    audio_length_ms = len(samples) * 1000 // frame_rate
+    music_start_ms, music_end_ms = resolve_music_window(audio_length_ms, duration_ms, music_start_ms, music_end_ms)
+    return samples[int(frame_rate * music_start_ms / 1000):int(frame_rate * music_end_ms / 1000)]
+
+def process_segment_pydub(audio, effects_list, duration_ms, music_start_ms=0, music_end_ms=None):
+    """Reference segment pipeline: every step produces a new AudioSegment"""
+    music_start_ms, music_end_ms = resolve_music_window(len(audio), duration_ms, music_start_ms, music_end_ms)
+
+    # Extract the desired portion of the music
+    audio = audio[music_start_ms:music_end_ms]
+    logging.info(f"Extracted audio segment: {len(audio)}ms")
+
+    # If the extracted audio is shorter than needed duration, loop it
+    while len(audio) < duration_ms:
+        audio = audio + audio
+        logging.info(f"Looped audio, new length: {len(audio)}ms")
+
+    # Trim to exact duration needed
+    audio = audio[:duration_ms]
+    logging.info(f"Final audio length: {len(audio)}ms for target: {duration_ms}ms")
+
+    # Apply effects in optimal order
+    logging.info(f"Applying effects: {effects_list}")
+
+    # 1. Pitch effects first (they can change timing)
+    if "Pitch Shift Up" in effects_list:
+        logging.info("Applying pitch shift up")
+        audio = create_pitch_shift(audio, 1.2)  # 20% higher pitch
+
+    if "Pitch Shift Down" in effects_list:
+        logging.info("Applying pitch shift down")
+        audio = create_pitch_shift(audio, 0.8)  # 20% lower pitch
+
+    # 2. Reverse effect
+    if "Reverse" in effects_list:
+        logging.info("Applying reverse effect")
+        audio = audio.reverse()
+
+    # 3. Volume effects
+    if "Volume Ramp Up" in effects_list:
+        logging.info("Applying volume ramp up")
+        audio = create_volume_ramp(audio, -20, 0, duration_ms)
+
+    if "Volume Ramp Down" in effects_list:
+        logging.info("Applying volume ramp down")
+        audio = create_volume_ramp(audio, 0, -20, duration_ms)
+
+    # 4. Spatial effects (Echo, Reverb)
+    if "Echo" in effects_list:
+        logging.info("Applying echo effect")
+        audio = create_echo_effect_pydub(audio, delay_ms=250, decay_factor=0.6, num_echoes=3)
+
+    if "Reverb" in effects_list:
+        logging.info("Applying reverb effect")
+        audio = create_reverb_effect_pydub(audio, room_size=0.6, damping=0.4, wet_level=0.3)
+
+    # 5. Fade effects (applied last to avoid interfering with other effects)
+    if "Fade In" in effects_list:
+        fade_duration = min(3000, duration_ms // 3)  # Max 3 seconds or 1/3 of duration
+        logging.info(f"Applying fade in: {fade_duration}ms")
+        audio = audio.fade_in(fade_duration)
+
+    if "Fade Out" in effects_list:
+        fade_duration = min(3000, duration_ms // 3)
+        logging.info(f"Applying fade out: {fade_duration}ms")
+        audio = audio.fade_out(fade_duration)
+
+    # 6. Final processing
     try:
-        try:
-            audio = AudioSegment.from_file(audio_path)
-            logging.info(f"Loaded audio file: {len(audio)}ms duration, {audio.channels} channels, {audio.frame_rate}Hz")
-        except Exception as e:
-            logging.error(f"Pydub failed to read audio: {e}")
-            return False
+        # Normalize audio to prevent clipping
+        audio = normalize(audio, headroom=1.0)
 
-        # Extract the specific portion of the music track
-        if music_end_ms is None:
-            music_end_ms = len(audio)
-        
-        # Ensure we don't exceed the audio file length
-        music_start_ms = min(music_start_ms, len(audio))
-        music_end_ms = min(music_end_ms, len(audio))
-        
-        if music_start_ms >= music_end_ms:
-            logging.warning(f"Invalid music timing: start {music_start_ms}ms >= end {music_end_ms}ms")
-            music_start_ms = 0
-            music_end_ms = min(duration_ms, len(audio))
-        
-        # Extract the desired portion of the music
-        audio = audio[music_start_ms:music_end_ms]
-        logging.info(f"Extracted audio segment: {len(audio)}ms")
-        
-        # If the extracted audio is shorter than needed duration, loop it
-        original_length = len(audio)
-        while len(audio) < duration_ms:
-            audio = audio + audio
-            logging.info(f"Looped audio, new length: {len(audio)}ms")
-        
-        # Trim to exact duration needed
-        audio = audio[:duration_ms]
-        logging.info(f"Final audio length: {len(audio)}ms for target: {duration_ms}ms")
+        # Apply gentle compression to even out dynamics
+        audio = compress_dynamic_range(audio, threshold=-20.0, ratio=2.0)
 
-        # Apply effects in optimal order
-        logging.info(f"Applying effects: {effects_list}")
-        
-        # 1. Pitch effects first (they can change timing)
-        if "Pitch Shift Up" in effects_list:
-            logging.info("Applying pitch shift up")
-            audio = create_pitch_shift(audio, 1.2)  # 20% higher pitch
-            
-        if "Pitch Shift Down" in effects_list:
-            logging.info("Applying pitch shift down")
-            audio = create_pitch_shift(audio, 0.8)  # 20% lower pitch
-
-        # 2. Reverse effect
-        if "Reverse" in effects_list:
-            logging.info("Applying reverse effect")
-            audio = audio.reverse()
-
-        # 3. Volume effects
-        if "Volume Ramp Up" in effects_list:
-            logging.info("Applying volume ramp up")
-            audio = create_volume_ramp(audio, -20, 0, duration_ms)
-            
-        if "Volume Ramp Down" in effects_list:
-            logging.info("Applying volume ramp down")
-            audio = create_volume_ramp(audio, 0, -20, duration_ms)
-
-        # 4. Spatial effects (Echo, Reverb)
-        if "Echo" in effects_list:
-            logging.info("Applying echo effect")
-            audio = create_echo_effect(audio, delay_ms=250, decay_factor=0.6, num_echoes=3)
-            
-        if "Reverb" in effects_list:
-            logging.info("Applying reverb effect")
-            audio = create_reverb_effect(audio, room_size=0.6, damping=0.4, wet_level=0.3)
-
-        # 5. Fade effects (applied last to avoid interfering with other effects)
-        if "Fade In" in effects_list:
-            fade_duration = min(3000, duration_ms // 3)  # Max 3 seconds or 1/3 of duration
-            logging.info(f"Applying fade in: {fade_duration}ms")
-            audio = audio.fade_in(fade_duration)
-            
-        if "Fade Out" in effects_list:
-            fade_duration = min(3000, duration_ms // 3)
-            logging.info(f"Applying fade out: {fade_duration}ms")
-            audio = audio.fade_out(fade_duration)
+        logging.info("Applied normalization and compression")
+    except Exception as e:
+        logging.warning(f"Failed to apply final processing: {e}")
+
+    return audio
+
+def process_segment_numpy(samples, frame_rate, effects_list, duration_ms, music_start_ms=0, music_end_ms=None):
+    """
+    Fused segment pipeline: the whole effect chain runs on one float32
+    buffer, which is returned as is for the mixer.
+    """
+    # Looping and trimming happen in a single indexed copy
+    window = segment_window(samples, frame_rate, duration_ms, music_start_ms, music_end_ms)
+    samples = audio_dsp.loop_to_length(window, int(frame_rate * duration_ms / 1000))
+    logging.info(f"Final audio length: {len(samples) * 1000 // frame_rate}ms for target: {duration_ms}ms")
 
-        # 6. Final processing
+    logging.info(f"Applying effects: {effects_list}")
+    samples = audio_dsp.apply_effect_chain(samples, frame_rate, effects_list, duration_ms)
+
+    # Gentle compression, then every segment is brought to the same integrated loudness
+    audio_dsp.normalize_peak(samples, headroom_db=1.0)
+    audio_dsp.compress_dynamics(samples, frame_rate, threshold_db=-20.0, ratio=2.0)
+    audio_dsp.normalize_loudness(samples, frame_rate, LOUDNESS_TARGET_LUFS, peak_ceiling_db=-1.0)
+    logging.info(f"Applied compression and loudness normalization to {LOUDNESS_TARGET_LUFS} LUFS")
+    return samples
+
+def process_segment(samples, frame_rate, effects_list, duration_ms, music_start_ms=0, music_end_ms=None):
+    """Trim/loop a decoded track to one segment and apply its effects; float32 array in, float32 array out"""
+    if AUDIO_DSP_ENGINE == "pydub":
+        audio = process_segment_pydub(audio_dsp.array_to_segment(samples, frame_rate), effects_list,
+                                      duration_ms, music_start_ms, music_end_ms)
+        return audio_dsp.segment_to_array(audio)
+    return process_segment_numpy(samples, frame_rate, effects_list, duration_ms, music_start_ms, music_end_ms)
+
+def _process_segment_job(job):
+    """Worker entry point; module-level so the process pool can pickle it"""
+    window, frame_rate, effects_list, duration_ms = job
+    return process_segment(window, frame_rate, effects_list, duration_ms)
+
+def _process_segment_streaming_job(job):
+    """
+    Worker entry point for streaming mode: decode just the segment's music
+    window to disk with ffmpeg, then process it block by block into out_path.
+    Returns the number of frames written.
+    """
+    path, frame_rate, effects_list, duration_ms, music_start_ms, music_end_ms, out_path = job
+    window_path = out_path + ".window"
+    try:
+        window_ms = None if music_end_ms is None else music_end_ms - music_start_ms
+        window = None
+        if window_ms is None or window_ms > 0:
+            window = audio_dsp.decode_audio_to_file(path, window_path, frame_rate, RENDER_CHANNELS,
+                                                    music_start_ms, window_ms)
+        if window is None or len(window) == 0:
+            # Same fallback as resolve_music_window: the start of the track, up to the segment's length
+            logging.warning(f"Invalid music timing: start {music_start_ms}ms, end {music_end_ms}ms")
+            window = audio_dsp.decode_audio_to_file(path, window_path, frame_rate, RENDER_CHANNELS, 0, duration_ms)
+        samples = audio_stream.process_segment_streaming(window, frame_rate, effects_list, duration_ms, out_path,
+                                                         LOUDNESS_TARGET_LUFS)
+        return len(samples)
+    finally:
+        if os.path.exists(window_path):
+            os.unlink(window_path)
+
+def process_segments(jobs, max_workers=None, worker=_process_segment_job):
+    """
+    Run the effect chain for every segment job, keyed by segment index.
+    A job is (window, frame_rate, effects_list, duration_ms), where window is
+    only the slice of the track the segment uses, so workers are sent that
+    rather than whole tracks. With more than one worker the jobs run in a
+    process pool. Returns (samples_by_idx, errors_by_idx) in the order of
+    jobs; a failing segment only lands in the errors dict.
+    worker is the module-level function run for each job.
+    """
+    workers = SEGMENT_WORKERS if max_workers is None else max_workers
+    samples_by_idx, errors_by_idx = {}, {}
+
+    if workers <= 1 or len(jobs) <= 1:
+        for idx, job in jobs.items():
+            try:
+                samples_by_idx[idx] = worker(job)
+            except Exception as e:
+                errors_by_idx[idx] = str(e)
+        return samples_by_idx, errors_by_idx
+
+    logging.info(f"Processing {len(jobs)} segments with {workers} workers")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        futures = {idx: executor.submit(worker, job) for idx, job in jobs.items()}
+        # Collected in submission order, so the result doesn't depend on which worker finishes first
+        for idx, future in futures.items():
+            try:
+                samples_by_idx[idx] = future.result()
+            except Exception as e:
+                errors_by_idx[idx] = str(e)
+    return samples_by_idx, errors_by_idx
+
+def segment_cache_key(track, effects_list, duration_ms, music_start_ms, music_end_ms, streaming=False,
+                      frame_rate=None):
+    """Hash of everything a processed segment depends on"""
+    return disk_cache.hash_key(
+        SEGMENT_ENGINE_VERSION,
+        AUDIO_DSP_ENGINE,
+        "streaming" if streaming else "memory",
+        track_identity(track),
+        music_start_ms,
+        music_end_ms,
+        duration_ms,
+        sorted(set(effects_list)),
+        frame_rate or RENDER_FRAME_RATE,
+        RENDER_CHANNELS,
+        LOUDNESS_TARGET_LUFS
+    )
+
+def _segment_cache_path(key):
+    return os.path.join(disk_cache.cache_dir("segments"), f"{key}.npy")
+
+def load_cached_segment(key, copy_path=None):
+    """
+    A cached processed segment, or None on a miss. With copy_path the entry
+    is copied there and memmapped (for streaming mode) instead of loaded; the
+    mixer scales segments in place, so the cache entry itself is never mapped
+    writable.
+    """
+    path = _segment_cache_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        if copy_path:
+            shutil.copyfile(path, copy_path)
+            samples = np.load(copy_path, mmap_mode="r+")
+        else:
+            samples = np.load(path)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable segment cache entry {path}: {e}")
+        return None
+    disk_cache.touch(path)
+    return samples
+
+def store_cached_segment(key, samples):
+    try:
+        disk_cache.atomic_save_array(_segment_cache_path(key), samples)
+        disk_cache.evict_lru(disk_cache.cache_dir("segments"), SEGMENT_CACHE_MAX_BYTES)
+    except OSError as e:
+        logging.warning(f"Failed to cache processed segment: {e}")
+
+def apply_audio_effects(audio_source, output_path, effects_list, duration_ms, music_start_ms=0, music_end_ms=None):
+    """
+    Apply audio effects to a segment with proper timing controls and enhanced effects,
+    and export the result as MP3. audio_source is a file path or an already decoded
+    AudioSegment. The renderer itself keeps segments in memory via process_segment.
+    """
+    try:
         try:
-            # Normalize audio to prevent clipping
-            audio = normalize(audio, headroom=1.0)
-            
-            # Apply gentle compression to even out dynamics
-            audio = compress_dynamic_range(audio, threshold=-20.0, ratio=2.0)
-            
-            logging.info("Applied normalization and compression")
+            if isinstance(audio_source, AudioSegment):
+                frame_rate = audio_source.frame_rate
+                samples = audio_dsp.segment_to_array(audio_source)
+            else:
+                frame_rate = RENDER_FRAME_RATE
+                samples = audio_dsp.decode_audio(audio_source, frame_rate, RENDER_CHANNELS)
+            logging.info(f"Loaded audio: {len(samples) * 1000 // frame_rate}ms duration, "
+                         f"{samples.shape[1]} channels, {frame_rate}Hz")
         except Exception as e:
-            logging.warning(f"Failed to apply final processing: {e}")
+            logging.error(f"Failed to read audio: {e}")
+            return False
+
+        samples = process_segment(samples, frame_rate, effects_list, duration_ms, music_start_ms, music_end_ms)
 
         # Export processed audio
         logging.info(f"Exporting processed audio to: {output_path}")
-        audio.export(output_path, format="mp3", bitrate="192k")
+        audio_dsp.array_to_segment(samples, frame_rate).export(output_path, format="mp3", bitrate="192k")
         
         success = os.path.exists(output_path)
         if success:
@@ -244,20 +539,202 @@ def apply_audio_effects(audio_path, output_path, effects_list, duration_ms, musi
         logging.error(f"Full traceback: {traceback.format_exc()}")
         return False
 
-def add_music_to_video(video_path, scene_assignments, output_path):
+def probe_video_codec(video_path):
+    """Codec name of the main video stream according to ffprobe, or None if it can't be probed"""
+    try:
+        info = mediainfo_json(video_path)
+    except Exception as e:
+        logging.warning(f"ffprobe failed on {video_path}: {e}")
+        return None
+    for stream in info.get("streams", []):
+        # Cover art shows up as a video stream too
+        if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic"):
+            return stream.get("codec_name")
+    return None
+
+def can_remux(video_path, output_path):
+    """Whether the source video stream can be copied into output_path's container unchanged"""
+    container = os.path.splitext(output_path)[1].lower()
+    if container not in REMUX_VIDEO_CODECS:
+        return False
+    codec = probe_video_codec(video_path)
+    if codec is None:
+        return False
+    allowed = REMUX_VIDEO_CODECS[container]
+    return allowed is None or codec in allowed
+
+def render_remux(video_path, audio_path, output_path):
+    """
+    Mux an encoded audio track with the source video stream via ffmpeg stream
+    copy. Returns False (leaving the caller to re-encode) if ffmpeg fails.
+    """
+    command = [
+        AudioSegment.converter, "-nostdin", "-v", "error", "-y",
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", "copy",
+        output_path
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        logging.warning(f"Remux failed: {e}")
+        return False
+    if result.returncode != 0:
+        logging.warning(f"Remux failed: {result.stderr.decode(errors='replace').strip()}")
+        return False
+    return True
+
+def render_x264(video, final_audio, output_path, temp_files):
+    """Re-encode the whole video through MoviePy with the new audio track"""
+    final_video = video.set_audio(final_audio)
+    temp_audiofile = tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name
+    temp_files.append(temp_audiofile)
+    try:
+        final_video.write_videofile(
+            output_path, 
+            codec="libx264", 
+            audio_codec="aac",
+            temp_audiofile=temp_audiofile,
+            remove_temp=True,
+            verbose=False,
+            logger=None  # Reduce verbose output
+        )
+    finally:
+        final_video.close()
+
+def decode_original_audio(video_path, video, raw_path=None, frame_rate=None):
+    """
+    The upload's own soundtrack at the render rate, or None if it has none or
+    can't be decoded. With raw_path it is decoded to that file and memmapped.
+    """
+    if video.audio is None:
+        return None
+    frame_rate = frame_rate or RENDER_FRAME_RATE
+    try:
+        if raw_path:
+            return audio_dsp.decode_audio_to_file(video_path, raw_path, frame_rate, RENDER_CHANNELS)
+        return audio_dsp.decode_audio(video_path, frame_rate, RENDER_CHANNELS)
+    except Exception as e:
+        logging.warning(f"Failed to decode original audio, mixing music only: {e}")
+        return None
+
+def preview_windows(scene_assignments, duration, preview_range=None):
+    """
+    Time ranges (seconds) a preview covers: preview_range clamped to the
+    video, or PREVIEW_SEAM_PADDING_SEC either side of every segment
+    boundary, merged where they overlap.
+    """
+    padding = PREVIEW_SEAM_PADDING_SEC
+    if preview_range:
+        start, end = max(0.0, preview_range[0]), min(duration, preview_range[1])
+        if end > start:
+            return [(start, end)]
+        seams = []
+    else:
+        seams = sorted({t for a in scene_assignments.values() for t in (a["start_time"], a["end_time"]) if 0 < t < duration})
+    if not seams:
+        return [(0.0, min(duration, 2 * padding))]
+
+    windows = []
+    for seam in seams:
+        start, end = max(0.0, seam - padding), min(duration, seam + padding)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return windows
+
+def render_preview(video_path, mix, frame_rate, windows, output_path, temp_files, fps=None):
+    """
+    Encode a preview: each window is cut from the source with input seeking,
+    scaled down to PREVIEW_HEIGHT, and the windows are concatenated and
+    encoded with x264 at PREVIEW_PRESET and a capped bitrate, together with
+    the matching slices of the mix. Raises on failure.
+    """
+    audio = np.concatenate([mix[int(round(start * frame_rate)):int(round(end * frame_rate))] for start, end in windows])
+    audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name
+    temp_files.append(audio_path)
+    audio_dsp.encode_audio(audio, frame_rate, audio_path, bitrate=PREVIEW_AUDIO_BITRATE)
+
+    command = [AudioSegment.converter, "-nostdin", "-v", "error", "-y"]
+    for start, end in windows:
+        command += ["-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", video_path]
+    command += ["-i", audio_path]
+    filters = "".join(
+        f"[{i}:v:0]scale=-2:'min(ih,{PREVIEW_HEIGHT})',setsar=1,setpts=PTS-STARTPTS[v{i}];"
+        for i in range(len(windows))
+    )
+    filters += "".join(f"[v{i}]" for i in range(len(windows))) + f"concat=n={len(windows)}:v=1:a=0[v]"
+    command += [
+        "-filter_complex", filters,
+        "-map", "[v]", "-map", f"{len(windows)}:a:0",
+        # The concat filter loses the source frame rate, so it is set explicitly
+        *(["-r", f"{fps:.3f}"] if fps else []),
+        "-c:v", "libx264", "-preset", PREVIEW_PRESET, "-pix_fmt", "yuv420p",
+        "-b:v", f"{PREVIEW_VIDEO_KBPS}k", "-maxrate", f"{PREVIEW_VIDEO_KBPS}k", "-bufsize", f"{2 * PREVIEW_VIDEO_KBPS}k",
+        "-c:a", "copy", "-shortest",
+        output_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to render the preview: {result.stderr.decode(errors='replace').strip()}")
+
+@dataclass
+class RenderResult:
+    """Outcome of add_music_to_video; truthy when the video was written"""
+    success: bool
+    output_path: str = None
+    segments_total: int = 0
+    segments_rendered: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    render_mode: str = None
+
+    def __bool__(self):
+        return self.success
+
+def add_music_to_video(video_path, scene_assignments, output_path, preview=False, preview_range=None):
     """
     Add music to video based on scene assignments.
     Works with both automatic scenes and manual segments.
+    With preview, only preview_range (start, end) in seconds, or the seams
+    between segments if it's None, is rendered: downscaled, fast-encoded,
+    with audio processed at PREVIEW_AUDIO_RATE.
+    Returns a RenderResult, which is falsy if rendering failed.
     """
+    temp_files = []  # Track temp files for cleanup
+    result = RenderResult(success=False, output_path=output_path, segments_total=len(scene_assignments))
     try:
         logging.info(f"Starting video rendering with {len(scene_assignments)} assignments")
         video = VideoFileClip(video_path)
-        audio_clips = []
-        
-        # Keep track of successful clips for debugging
-        successful_clips = 0
-        temp_files = []  # Track temp files for cleanup
 
+        streaming = AUDIO_PROCESSING_MODE == "streaming"
+        if streaming and AUDIO_DSP_ENGINE == "pydub":
+            logging.warning("Streaming audio processing needs the numpy engine; processing in memory")
+            streaming = False
+        if streaming:
+            # Decoded windows, processed segments and the mix all live here as raw float32 files
+            work_dir = tempfile.mkdtemp(prefix="tmprender")
+            temp_files.append(work_dir)
+
+        # Segments that run straight into another one render a little extra to crossfade with
+        frame_rate = PREVIEW_AUDIO_RATE if preview else RENDER_FRAME_RATE
+        crossfade_ms = SEGMENT_CROSSFADE_MS
+        segment_starts = {round(a["start_time"] * frame_rate) for a in scene_assignments.values()}
+        total_frames = int(round(video.duration * frame_rate))
+
+        if preview:
+            windows = preview_windows(scene_assignments, video.duration, preview_range)
+            logging.info(f"Preview render of {windows}")
+            # Only segments that can be heard in the preview are processed
+            scene_assignments = {
+                idx: a for idx, a in scene_assignments.items()
+                if any(a["start_time"] < end and a["end_time"] > start for start, end in windows)
+            }
+            result.segments_total = len(scene_assignments)
+
+        segments, plans, cache_keys, segment_audio = {}, {}, {}, {}
         for idx, assignment in sorted(scene_assignments.items()):
             start = assignment["start_time"]
             end = assignment["end_time"]
@@ -274,121 +751,156 @@ def add_music_to_video(video_path, scene_assignments, output_path):
 
             logging.info(f"Processing segment {idx}: {start:.2f}s-{end:.2f}s, track: {track['name']}, effects: {effects}")
 
-            # Create temporary files
-            raw_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
-            processed_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
-            temp_files.extend([raw_path, processed_path])
+            # Assignments carried over from a longer video can start after this one ends
+            if round(start * frame_rate) >= total_frames:
+                logging.warning(f"Skipping segment {idx} ({track['name']}): starts at {start:.2f}s, "
+                                f"after the end of the video ({video.duration:.2f}s)")
+                continue
 
-            success = False
-            
-            # Handle different audio sources
-            if track["source"] == "youtube":
-                success = download_youtube_audio(track["audio_url"], raw_path)
-                if not success:
-                    logging.warning(f"Skipping segment {idx}: failed to download {track['name']}")
-                    continue
-            elif track["source"] == "local":
+            if crossfade_ms and round(end * frame_rate) in segment_starts:
+                duration_ms += crossfade_ms
+            segments[idx] = (start, end, track)
+            plans[idx] = (effects, duration_ms, music_start_ms, music_end_ms)
+
+            # Segments whose inputs haven't changed since an earlier render come straight from the cache
+            if SEGMENT_CACHE:
                 try:
-                    # Copy local file to temp location for processing
-                    local_audio = AudioSegment.from_file(track["path"])
-                    local_audio.export(raw_path, format="mp3", bitrate="192k")
-                    success = True
-                    logging.info(f"Successfully loaded local file: {track['name']}")
-                except Exception as e:
-                    logging.warning(f"Skipping segment {idx}: failed to process local audio: {e}")
+                    cache_keys[idx] = segment_cache_key(track, effects, duration_ms, music_start_ms, music_end_ms,
+                                                        streaming, frame_rate)
+                except OSError as e:
+                    logging.warning(f"Segment {idx} can't be cached: {e}")
                     continue
-            else:
-                logging.warning(f"Skipping segment {idx}: unknown source type: {track.get('source', 'unknown')}")
-                continue
+                cached = load_cached_segment(
+                    cache_keys[idx],
+                    os.path.join(work_dir, f"segment-{idx}.raw") if streaming else None
+                )
+                if cached is not None:
+                    segment_audio[idx] = cached
+                    logging.info(f"Segment {idx} reused from the segment cache")
+        cache_hits = len(segment_audio)
 
-            if not success:
-                logging.warning(f"Skipping segment {idx}: failed to prepare audio")
-                continue
+        # Fetch (and unless streaming, decode) the tracks the remaining segments need, concurrently
+        pending = {idx: scene_assignments[idx] for idx in segments if idx not in segment_audio}
+        track_audio, track_errors = prefetch_tracks(pending, decode=not streaming, frame_rate=frame_rate)
 
-            # Apply effects and timing
-            effect_success = apply_audio_effects(
-                raw_path, 
-                processed_path, 
-                effects, 
-                duration_ms,
-                music_start_ms,
-                music_end_ms
-            )
-            
-            if not effect_success:
-                logging.warning(f"Skipping segment {idx}: failed to apply effects to {track['name']}")
+        jobs, segment_errors = {}, {}
+        for idx in pending:
+            track = segments[idx][2]
+            effects, duration_ms, music_start_ms, music_end_ms = plans[idx]
+            key = track_key(track)
+            if key not in track_audio:
+                segment_errors[idx] = f"failed to prepare {track['name']}: {track_errors.get(key, 'unknown error')}"
                 continue
+            if streaming:
+                jobs[idx] = (track_audio[key], frame_rate, effects, duration_ms, music_start_ms, music_end_ms,
+                             os.path.join(work_dir, f"segment-{idx}.raw"))
+            else:
+                window = segment_window(track_audio[key], frame_rate, duration_ms, music_start_ms, music_end_ms)
+                jobs[idx] = (window, frame_rate, effects, duration_ms)
 
-            # Create MoviePy audio clip
-            try:
-                audio_clip = AudioFileClip(processed_path).set_start(start).set_duration(end - start)
-                audio_clips.append(audio_clip)
-                successful_clips += 1
-                logging.info(f"Successfully created audio clip for segment {idx}")
-            except Exception as e:
-                logging.warning(f"Skipping segment {idx}: MoviePy couldn't load audio - {str(e)}")
+        # Apply effects and timing; each segment stays a float32 array all the way to the mixer
+        if streaming:
+            processed, errors = process_segments(jobs, worker=_process_segment_streaming_job)
+            processed = {idx: audio_stream.open_processed_segment(jobs[idx][-1], RENDER_CHANNELS) for idx in processed}
+        else:
+            processed, errors = process_segments(jobs)
+        segment_errors.update({idx: f"failed to apply effects: {error}" for idx, error in errors.items()})
+
+        # Cached before mixing, since the mixer scales segment buffers in place
+        for idx, samples in processed.items():
+            if idx in cache_keys:
+                store_cached_segment(cache_keys[idx], samples)
+        segment_audio.update(processed)
+        result.cache_hits, result.cache_misses = cache_hits, len(jobs)
+
+        placed = []
+        for idx, (start, end, track) in segments.items():
+            if idx not in segment_audio:
+                logging.warning(f"Skipping segment {idx} ({track['name']}): {segment_errors.get(idx, 'unknown error')}")
                 continue
+            start_frame = round(start * frame_rate)
+            placed.append((start_frame, segment_audio[idx], round(end * frame_rate) - start_frame))
 
-        logging.info(f"Created {successful_clips} successful audio clips out of {len(scene_assignments)} assignments")
+        result.segments_rendered = len(placed)
+        logging.info(f"Processed {len(placed)} segments out of {len(scene_assignments)} assignments "
+                     f"({cache_hits} from the segment cache)")
 
-        if not audio_clips:
-            logging.error("No audio clips were successfully created.")
-            return False
+        if not placed:
+            if preview and not scene_assignments:
+                # Nothing assigned in this stretch; the preview still shows it with the original audio
+                logging.info("No segments fall in the preview; rendering it with the original audio only")
+            else:
+                logging.error("No audio segments were successfully processed.")
+                return result
 
-        # Combine all audio clips
         try:
-            if len(audio_clips) == 1:
-                final_audio = audio_clips[0]
+            # Mix music and the ducked original soundtrack into one PCM timeline covering the whole video
+            if streaming:
+                mix = audio_stream.open_scratch(os.path.join(work_dir, "mix.raw"), total_frames, RENDER_CHANNELS)
+                background = decode_original_audio(video_path, video, os.path.join(work_dir, "original.raw"), frame_rate)
             else:
-                final_audio = CompositeAudioClip(audio_clips)
-            
-            # Create final video with music
-            # Keep original video audio and mix with new music
-            if video.audio is not None:
-                # Mix original audio with music (reduce original volume)
-                original_audio = video.audio.volumex(0.3)  # Reduce original to 30%
-                final_audio = CompositeAudioClip([original_audio, final_audio.volumex(0.8)])
-            
-            final_video = video.set_audio(final_audio)
-            
-            # Write the final video with optimized settings
-            logging.info(f"Writing final video to: {output_path}")
-            final_video.write_videofile(
-                output_path, 
-                codec="libx264", 
-                audio_codec="aac",
-                temp_audiofile=tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name,
-                remove_temp=True,
-                verbose=False,
-                logger=None  # Reduce verbose output
+                mix, background = None, decode_original_audio(video_path, video, frame_rate=frame_rate)
+            mix = audio_dsp.mix_segments(
+                placed,
+                total_frames,
+                RENDER_CHANNELS,
+                gain=MUSIC_GAIN if background is not None else 1.0,
+                background=background,
+                background_gain=ORIGINAL_AUDIO_GAIN,
+                crossfade_frames=int(frame_rate * crossfade_ms / 1000),
+                out=mix,
+                block_frames=audio_stream.BLOCK_FRAMES if streaming else None
             )
+
+            if RENDER_MODE not in RENDER_MODES:
+                raise ValueError(f"Unknown render mode: {RENDER_MODE}")
+            remuxed = False
+            if preview:
+                logging.info(f"Writing preview to: {output_path}")
+                render_preview(video_path, mix, frame_rate, windows, output_path, temp_files, video.fps)
+                result.render_mode = "preview"
+            elif RENDER_MODE == "remux" or (RENDER_MODE == "auto" and can_remux(video_path, output_path)):
+                logging.info(f"Remuxing final video to: {output_path}")
+                try:
+                    audio_path = tempfile.NamedTemporaryFile(delete=False, suffix=".m4a").name
+                    temp_files.append(audio_path)
+                    audio_dsp.encode_audio(mix, frame_rate, audio_path)
+                    remuxed = render_remux(video_path, audio_path, output_path)
+                except Exception as e:
+                    logging.warning(f"Failed to encode the mixed audio for remuxing: {e}")
+            if not remuxed and not preview:
+                # Write the final video with optimized settings
+                logging.info(f"Writing final video to: {output_path}")
+                final_audio = AudioArrayClip(mix, fps=frame_rate)
+                render_x264(video, final_audio, output_path, temp_files)
+                final_audio.close()
             
             # Clean up MoviePy objects
-            final_video.close()
-            final_audio.close()
-            for clip in audio_clips:
-                clip.close()
             video.close()
             
-            logging.info("Video rendering completed successfully")
-            return True
+            result.render_mode = result.render_mode or ("remux" if remuxed else "x264")
+            result.success = True
+            logging.info(f"Video rendering completed successfully: {result}")
+            return result
 
         except Exception as e:
             logging.error(f"Failed to create final video: {str(e)}")
             import traceback
             logging.error(f"Full traceback: {traceback.format_exc()}")
-            return False
+            return result
 
     except Exception as e:
         logging.error(f"Video rendering failed: {str(e)}")
         import traceback
         logging.error(f"Full traceback: {traceback.format_exc()}")
-        return False
+        return result
     finally:
         # Clean up temp files
         for temp_file in temp_files:
             try:
-                if os.path.exists(temp_file):
+                if os.path.isdir(temp_file):
+                    shutil.rmtree(temp_file, ignore_errors=True)
+                elif os.path.exists(temp_file):
                     os.unlink(temp_file)
             except Exception as e:
                 logging.warning(f"Failed to clean up temp file {temp_file}: {e}")